@@ -0,0 +1,72 @@
+"""
+Benchmark dot plot rendering: drawing every segment pair with `ax.plot`
+(the former approach) versus a single line collection (`plot_segments`),
+optionally rasterized. Uses a synthetic set of segments.
+
+    python benchmarks/bench_dotplot.py [-n 20000] [--format png]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from src.dotplot import plot_segments
+
+
+def synthetic_segments(n, size=1e9, seed=1):
+    rng = np.random.RandomState(seed)
+    x0 = rng.uniform(0, size, n)
+    y0 = rng.uniform(0, size, n)
+    d = rng.uniform(1e4, 1e6, n)
+    return pd.DataFrame({"multiplicon": np.arange(n), "x0": x0,
+        "x1": x0 + d, "y0": y0, "y1": y0 + d})
+
+
+def plot_segments_lines(ax, segs, linewidth=2, color="k", rasterized=False):
+    for x in segs.itertuples():
+        ax.plot([x.x0, x.x1], [x.y0, x.y1], color=color, linewidth=linewidth,
+            rasterized=rasterized)
+        ax.plot([x.y0, x.y1], [x.x0, x.x1], color=color, linewidth=linewidth,
+            rasterized=rasterized)
+
+
+def render(f, segs, fname, rasterized):
+    t0 = time.perf_counter()
+    fig, ax = plt.subplots(figsize=(8, 8))
+    f(ax, segs, rasterized=rasterized)
+    ax.set_xlim(0, 1e9)
+    ax.set_ylim(0, 1e9)
+    t1 = time.perf_counter()
+    fig.canvas.draw()
+    t2 = time.perf_counter()
+    fig.savefig(fname)
+    t3 = time.perf_counter()
+    plt.close(fig)
+    return t1 - t0, t2 - t1, t3 - t2
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-n", "--segments", type=int, default=20000)
+    p.add_argument("--format", default="png")
+    args = p.parse_args()
+    segs = synthetic_segments(args.segments)
+    print("{} segment pairs, {} output".format(len(segs), args.format))
+    print("method\tbuild (s)\tdraw (s)\tsave (s)")
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "dotplot." + args.format)
+        for name, f, r in [("per-segment", plot_segments_lines, False),
+                ("collection", plot_segments, False),
+                ("collection (rasterized)", plot_segments, True)]:
+            t = render(f, segs, fname, r)
+            print("{}\t{:.3f}\t{:.3f}\t{:.3f}".format(name, *t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark the native GFF3 reader against the former gffutils/SQLite based
+approach. Either pass GFF files (and the feature/attribute to use) or let the
+script generate a synthetic GFF file.
+
+    python benchmarks/bench_gffparser.py [-f gene] [-a ID] [gff ...]
+    python benchmarks/bench_gffparser.py --ngenes 50000
+
+Requires `gffutils` for the reference timings.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from src.gffparser import load_gff, write_gene_lists
+
+
+def synthetic_gff(fname, ngenes, nchrom=10, seed=1):
+    random.seed(seed)
+    with open(fname, "w") as f:
+        f.write("##gff-version 3\n")
+        for i in range(ngenes):
+            chrom = "chr{}".format(i % nchrom)
+            start = random.randint(1, 10**8)
+            stop = start + random.randint(500, 5000)
+            strand = random.choice("+-")
+            gid = "g{}".format(i)
+            f.write("\t".join([chrom, "bench", "gene", str(start), str(stop),
+                ".", strand, ".", "ID={0};Name={0}".format(gid)]) + "\n")
+            f.write("\t".join([chrom, "bench", "mRNA", str(start), str(stop),
+                ".", strand, ".", "ID={0}.1;Parent={0}".format(gid)]) + "\n")
+
+
+def gffutils_gene_lists(fn, feat, attr):
+    import gffutils
+    with open(fn, "r") as f:
+        lines = [l for l in f.readlines() if
+            (l[0] != "#" and l.split("\t")[2] in feat)]
+    gff = tempfile.NamedTemporaryFile(suffix=".gff", mode="w+t")
+    gff.write("".join(lines))
+    gff.seek(0)
+    dbfn = tempfile.NamedTemporaryFile(suffix=".db")
+    db = gffutils.create_db(gff.name, dbfn=dbfn.name, force=True,
+        merge_strategy='merge')
+    n = 0
+    for f in feat:
+        for g in db.features_of_type(f, order_by='start'):
+            g.attributes[attr][0], g.chrom, g.strand, g.start, g.stop
+            n += 1
+    return n
+
+
+def native_gene_lists(fn, feat, attr, outdir):
+    gff = load_gff(fn, feat, attr)
+    genes = {g: "fam" for g in gff["id"]}
+    write_gene_lists(gff, genes, "bench", outdir, attr=attr, features=feat)
+    return len(gff.index)
+
+
+def timeit(f, *args):
+    t0 = time.perf_counter()
+    n = f(*args)
+    return time.perf_counter() - t0, n
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("gff", nargs="*")
+    p.add_argument("-f", "--features", default="gene")
+    p.add_argument("-a", "--attribute", default="ID")
+    p.add_argument("--ngenes", type=int, default=20000)
+    p.add_argument("--no_gffutils", action="store_true")
+    args = p.parse_args()
+    feat = args.features.split(";")
+    with tempfile.TemporaryDirectory() as tmp:
+        gffs = args.gff
+        if not gffs:
+            gffs = [os.path.join(tmp, "synthetic.gff")]
+            synthetic_gff(gffs[0], args.ngenes)
+        for fn in gffs:
+            t1, n1 = timeit(native_gene_lists, fn, feat, args.attribute, tmp)
+            print("{}\tnative\t{} features\t{:.3f} s".format(fn, n1, t1))
+            if args.no_gffutils:
+                continue
+            t2, n2 = timeit(gffutils_gene_lists, fn, feat, args.attribute)
+            print("{}\tgffutils\t{} features\t{:.3f} s ({:.1f}x)".format(
+                fn, n2, t2, t2/t1))
+
+
+if __name__ == '__main__':
+    main()
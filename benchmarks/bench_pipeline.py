@@ -0,0 +1,146 @@
+"""
+Benchmark every stage of the py-adhore pipeline on synthetic data (see
+`synthetic.py`), from the OrthoFinder table to the visualizations. For every
+stage the wall time, CPU time and peak memory (increase of the resident set
+size high-water mark, Linux only) are recorded, and all results are written
+to a JSON file so that runs can be compared.
+
+    python benchmarks/bench_pipeline.py [--genomes 10] [--genes 20000] \\
+        [--multiplicons 5000] [-o bench.json] [--compare old.json]
+
+I-ADHoRe itself is not run, its output is generated by `synthetic.py`.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import synthetic
+from src.orthofinder import get_families_orthofinder, \
+    write_families_from_df, orthogroup_poisson_filter
+from src.gffparser import gffs_to_genelists
+from src.store import write_genes_data, read_genes_data
+from src.adhore import summarize_adhore
+from src.circos import ribbons_to_json
+from src.network import get_clusters
+from src.dotplot import get_segments
+from src.split import merge_results
+from src.profiling import peak_rss, reset_peak_rss
+
+
+def measure(results, stage, f, *args, **kwargs):
+    reset_peak_rss()
+    rss0 = peak_rss()
+    t0, c0 = time.perf_counter(), time.process_time()
+    ch0 = sum(os.times()[2:4])
+    out = f(*args, **kwargs)
+    t1, c1 = time.perf_counter(), time.process_time()
+    ch1 = sum(os.times()[2:4])
+    rss1 = peak_rss()
+    # CPU time of worker processes (e.g. with --processes) is reported
+    # separately, the peak memory is that of the benchmark process only
+    results[stage] = {"wall": t1 - t0, "cpu": c1 - c0,
+        "cpu_children": ch1 - ch0,
+        "peak_rss_kb": None if rss0 is None else rss1 - rss0}
+    print("{:<28}{:>10.3f} s{:>10.3f} s cpu{:>12} kB".format(stage, t1 - t0,
+        c1 - c0, "-" if rss0 is None else rss1 - rss0), file=sys.stderr)
+    return out
+
+
+def run(args, tmp):
+    results = {}
+    genes = measure(results, "synthetic.genomes", synthetic.make_genomes,
+        args.genomes, args.genes, args.chromosomes, seed=args.seed)
+    species = list(genes["sp"].unique())
+    gffs = measure(results, "synthetic.gffs", synthetic.write_gffs, genes,
+        tmp)
+    ogs = measure(results, "synthetic.orthogroups",
+        synthetic.write_orthogroups, genes,
+        synthetic.assign_families(genes, seed=args.seed),
+        os.path.join(tmp, "Orthogroups.tsv"))
+    del genes
+
+    df = measure(results, "get_families_orthofinder",
+        get_families_orthofinder, ogs, species)
+    measure(results, "orthogroup_poisson_filter", orthogroup_poisson_filter,
+        df, threshold=3)
+    fn, fams = measure(results, "write_families_from_df",
+        write_families_from_df, df, os.path.join(tmp, "families.tsv"))
+    del df
+    _, gdata = measure(results, "gffs_to_genelists", gffs_to_genelists, gffs,
+        [["gene"]] * len(gffs), ["ID"] * len(gffs), fams, tmp,
+        processes=args.processes)
+    del fams
+    gfile = os.path.join(tmp, "genes_data.csv")
+    write_genes_data(gdata, gfile)
+    gdata = read_genes_data(gfile)
+
+    iadhore = os.path.join(tmp, "i-adhore-out")
+    os.makedirs(iadhore)
+    seg = measure(results, "synthetic.adhore_output", synthetic.adhore_output,
+        gdata, iadhore, args.multiplicons, seed=args.seed)
+    jobs = pd.DataFrame({"name": ["all"], "pairwise": [0],
+        "output_path": [iadhore]})
+    measure(results, "merge_results", merge_results, jobs,
+        os.path.join(tmp, "merged"))
+    summary = measure(results, "summarize_adhore", summarize_adhore, iadhore,
+        gfile, os.path.join(tmp, "py-adhore.csv"))
+    measure(results, "ribbons_to_json", ribbons_to_json, seg, gdata,
+        minlen=0)
+    measure(results, "get_clusters", get_clusters,
+        os.path.join(iadhore, "anchorpoints.txt"), gdata)
+    df = pd.read_csv(summary, index_col=0)
+    kt = gdata.groupby(["chrom"], observed=True)[["stop", "sp"]].max()
+    # chromosome ends on the dot plot axes, as in `karyotype_axes`
+    genomes = list(kt["sp"].unique())
+    g1, g2 = genomes[0], genomes[1 % len(genomes)]
+    ticks = [kt[kt["sp"] == g]["stop"].sort_values(ascending=False).cumsum()
+        for g in [g1, g2]]
+    segs = measure(results, "get_segments", get_segments, df, g1, g2, *ticks)
+    results["get_segments"]["segment_pairs"] = len(segs.index)
+    return results
+
+
+def compare(old, new):
+    print("{:<28}{:>12}{:>12}{:>8}".format("stage", "old (s)", "new (s)",
+        "ratio"), file=sys.stderr)
+    for stage, r in new["stages"].items():
+        if stage not in old["stages"]:
+            continue
+        t0, t1 = old["stages"][stage]["wall"], r["wall"]
+        print("{:<28}{:>12.3f}{:>12.3f}{:>8.2f}".format(stage, t0, t1,
+            t1 / t0 if t0 > 0 else float("nan")), file=sys.stderr)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--genomes", type=int, default=10)
+    p.add_argument("--genes", type=int, default=20000,
+        help="number of genes per genome")
+    p.add_argument("--chromosomes", type=int, default=10)
+    p.add_argument("--multiplicons", type=int, default=5000)
+    p.add_argument("--processes", "-p", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--output", "-o", default="bench_pipeline.json")
+    p.add_argument("--compare", default=None,
+        help="results of a previous run to compare with")
+    args = p.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args, tmp)
+    report = {"parameters": vars(args), "python": sys.version.split()[0],
+        "pandas": pd.__version__, "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to {}".format(args.output), file=sys.stderr)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
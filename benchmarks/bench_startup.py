@@ -0,0 +1,75 @@
+"""
+Benchmark the start-up time of the py-adhore CLI for every subcommand, by
+timing `pyadhore.py <subcommand> -h` and recording the modules imported in
+that case (using `python -X importtime`).
+
+    python benchmarks/bench_startup.py [-r 5] [--top 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PYADHORE = os.path.join(os.path.dirname(__file__), "..", "pyadhore.py")
+HEAVY = ["pandas", "numpy", "matplotlib", "networkx", "gffutils"]
+
+
+def subcommands():
+    sys.path.insert(0, os.path.dirname(PYADHORE))
+    from pyadhore import cli
+    return sorted(cli.commands)
+
+
+def startup_time(args, repeats):
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, PYADHORE] + args,
+            stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def import_profile(args):
+    """
+    Parse the `-X importtime` output, returns the cumulative import time in
+    seconds per top-level module.
+    """
+    p = subprocess.run([sys.executable, "-X", "importtime", PYADHORE] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    cumulative = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line.split("|")
+        if fields[1].strip() == "cumulative":
+            continue
+        name = fields[2].rstrip()
+        if len(name) - len(name.lstrip()) > 1:
+            continue  # only top-level imports
+        cumulative[name.strip()] = int(fields[1]) * 1e-6
+    return cumulative
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("-r", "--repeats", type=int, default=5)
+    p.add_argument("--top", type=int, default=5)
+    args = p.parse_args()
+    for cmd in [[]] + [[c] for c in subcommands()]:
+        argv = cmd + ["-h"]
+        t = startup_time(argv, args.repeats)
+        imports = import_profile(argv)
+        heavy = [m for m in HEAVY if m in imports]
+        top = sorted(imports.items(), key=lambda x: -x[1])[:args.top]
+        print("{:<6} {:.3f} s  heavy: {}".format(
+            cmd[0] if cmd else "-", t, ",".join(heavy) or "none"))
+        for m, s in top:
+            print("         {:.3f} s  {}".format(s, m))
+
+
+if __name__ == '__main__':
+    main()
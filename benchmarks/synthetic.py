@@ -0,0 +1,191 @@
+"""
+Seeded generator of synthetic py-adhore inputs and I-ADHoRe outputs: genomes
+(genes on chromosomes), GFF3 files, an OrthoFinder `Orthogroups.tsv` table
+and I-ADHoRe-shaped `segments.txt`, `multiplicons.txt` and
+`anchorpoints.txt`. Everything is generated with array operations, so that
+inputs with up to ~100 genomes and millions of genes can be made quickly.
+
+    python benchmarks/synthetic.py OUTDIR [--genomes 10] [--genes 20000]
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+
+def make_genomes(ngenomes=10, ngenes=20000, nchrom=10, spacing=5000,
+        seed=1):
+    """
+    Genes for `ngenomes` genomes (named `sp<i>`, zero-padded so that genome
+    names are not prefixes of each other) with `ngenes` genes each,
+    spread over `nchrom` chromosomes. Returns a data frame with `id`, `sp`,
+    `chrom`, `start`, `stop` and `strand`, sorted by genome, chromosome and
+    start.
+    """
+    rng = np.random.default_rng(seed)
+    n = ngenomes * ngenes
+    sp = np.repeat(np.arange(ngenomes), ngenes)
+    chrom = np.sort(rng.integers(0, nchrom, size=(ngenomes, ngenes)),
+        axis=1).ravel()
+    # rank of every gene on its chromosome
+    key = sp * nchrom + chrom
+    first = np.r_[0, np.nonzero(np.diff(key))[0] + 1]
+    rank = np.arange(n) - np.repeat(first, np.diff(np.r_[first, n]))
+    start = rank * spacing + rng.integers(1, spacing // 2, size=n)
+    stop = start + rng.integers(spacing // 10, spacing // 2, size=n)
+    sps = np.char.add("sp", np.char.zfill(sp.astype(str),
+        len(str(ngenomes - 1))))
+    return pd.DataFrame({
+        "id": np.char.add(np.char.add(sps, "_g"), np.arange(n).astype(str)),
+        "sp": sps,
+        "chrom": np.char.add(np.char.add(sps, "_chr"), chrom.astype(str)),
+        "start": start, "stop": stop,
+        "strand": np.where(rng.random(n) < 0.5, "+", "-")})
+
+
+def write_gffs(genes, outdir):
+    """
+    Write one GFF3 file (`<sp>.gff`) per genome, with a gene and an mRNA
+    feature for every gene. Returns the file names.
+    """
+    fnames = []
+    for sp, df in genes.groupby("sp", sort=False):
+        fname = os.path.join(outdir, "{}.gff".format(sp))
+        rows = []
+        for feat, attr in [("gene", "ID=" + df["id"]),
+                ("mRNA", "ID=" + df["id"] + ".1;Parent=" + df["id"])]:
+            rows.append(pd.DataFrame({"chrom": df["chrom"], "source": "syn",
+                "feat": feat, "start": df["start"], "stop": df["stop"],
+                "score": ".", "strand": df["strand"], "phase": ".",
+                "attr": attr}))
+        with open(fname, "w") as f:
+            f.write("##gff-version 3\n")
+            pd.concat(rows).sort_index(kind="mergesort").to_csv(f, sep="\t",
+                header=False, index=False)
+        fnames.append(fname)
+    return fnames
+
+
+def assign_families(genes, family_size=4, outliers=0.01, seed=1):
+    """
+    Random gene family (integer) for every gene, with mean family size
+    `family_size`. A fraction `outliers` of the families is inflated with
+    many more genes, so that the Poisson outlier filter has work to do.
+    """
+    rng = np.random.default_rng(seed)
+    nfam = max(1, len(genes.index) // family_size)
+    fam = rng.integers(0, nfam, size=len(genes.index))
+    big = rng.random(len(genes.index)) < outliers * family_size / 10
+    fam[big] = rng.integers(0, max(1, int(nfam * outliers)), size=big.sum())
+    return fam
+
+
+def write_orthogroups(genes, families, fname):
+    """
+    Write an OrthoFinder `Orthogroups.tsv` table for the genes and their
+    families (one row per family, one column per genome).
+    """
+    df = pd.DataFrame({"family": families, "sp": genes["sp"].values,
+        "id": genes["id"].values})
+    og = df.groupby(["family", "sp"])["id"].agg(", ".join).unstack().fillna("")
+    og.index = ["OG{:07d}".format(i) for i in og.index]
+    og.index.name = "Orthogroup"
+    og.columns.name = None
+    og.to_csv(fname, sep="\t")
+    return os.path.abspath(fname)
+
+
+def adhore_output(gdata, outdir, nmultiplicons=1000, seed=1, minlen=5,
+        maxlen=40, maxorder=4):
+    """
+    Write I-ADHoRe-shaped `segments.txt`, `multiplicons.txt` and
+    `anchorpoints.txt` to `outdir` for the genes data `gdata` (as written by
+    `gffs_to_genelists`). Multiplicons come in nested families of 2 to
+    `maxorder` segments of the same number of genes on random chromosomes:
+    as in I-ADHoRe, a family has a level 2 multiplicon (without parent) with
+    its first two segments, and every higher level multiplicon has one more
+    segment and the multiplicon one level lower as parent. Anchor points
+    pair the genes of the first and the last segment of every multiplicon.
+    """
+    rng = np.random.default_rng(seed)
+    gd = gdata.sort_values(["chrom", "start"])
+    chrom = gd["chrom"].astype(str).values
+    sp = gd["sp"].astype(str).values
+    bounds = np.r_[0, np.nonzero(chrom[1:] != chrom[:-1])[0] + 1, len(chrom)]
+    sizes = np.diff(bounds)
+    maxlen = min(maxlen, sizes.min())
+    minlen = min(minlen, maxlen)
+    # families, with segments of the same length
+    forder = rng.integers(2, maxorder + 1, size=nmultiplicons)
+    nfam = np.searchsorted(np.cumsum(forder - 1), nmultiplicons) + 1
+    forder = forder[:nfam]
+    flen = rng.integers(minlen, maxlen + 1, size=nfam)
+    fseglen = np.repeat(flen, forder)
+    c = rng.integers(0, len(sizes), size=len(fseglen))
+    ffirst = bounds[c] + (rng.random(len(fseglen)) *
+        (sizes[c] - fseglen + 1)).astype(np.int64)
+    fs0 = np.cumsum(forder) - forder
+    # multiplicons of level 2 up to the order of their family
+    nm = forder - 1
+    mfam = np.repeat(np.arange(nfam), nm)[:nmultiplicons]
+    level = (2 + np.arange(nm.sum()) - np.repeat(np.cumsum(nm) - nm,
+        nm))[:nmultiplicons]
+    mid = np.arange(1, len(mfam) + 1)
+    # segments
+    mult = np.repeat(mid, level)
+    k = np.arange(level.sum()) - np.repeat(np.cumsum(level) - level, level)
+    s = np.repeat(fs0[mfam], level) + k
+    first = ffirst[s]
+    last = first + fseglen[s] - 1
+    genes = gd.index.values
+    segs = pd.DataFrame({"id": np.arange(1, len(mult) + 1),
+        "multiplicon": mult, "genome": sp[first], "list": chrom[first],
+        "first": genes[first], "last": genes[last], "order": k})
+    segs.to_csv(os.path.join(outdir, "segments.txt"), sep="\t", index=False)
+    # anchor points between the first and last segment of every multiplicon
+    length = flen[mfam]
+    kk = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length,
+        length)
+    fx, fy = ffirst[fs0[mfam]], ffirst[fs0[mfam] + level - 1]
+    x = np.repeat(fx, length) + kk
+    y = np.repeat(fy, length) + kk
+    aps = pd.DataFrame({"id": np.arange(1, len(kk) + 1),
+        "multiplicon": np.repeat(mid, length),
+        "basecluster": 0, "gene_x": genes[x], "gene_y": genes[y],
+        "coord_x": kk, "coord_y": kk, "is_real_anchorpoint": 1})
+    aps.to_csv(os.path.join(outdir, "anchorpoints.txt"), sep="\t",
+        index=False)
+    # above level 2, the x side of a multiplicon is the profile of its parent
+    top = level == 2
+    mps = pd.DataFrame({"id": mid,
+        "genome_x": np.where(top, sp[fx], ""),
+        "list_x": np.where(top, chrom[fx], ""),
+        "parent": pd.Series(mid - 1, dtype="Int64").mask(top).values,
+        "genome_y": sp[fy], "list_y": chrom[fy], "level": level,
+        "number_of_anchorpoints": length, "profile_length": length,
+        "begin_x": 0, "end_x": length, "begin_y": 0, "end_y": length,
+        "is_redundant": 0})
+    mps.to_csv(os.path.join(outdir, "multiplicons.txt"), sep="\t",
+        index=False)
+    return segs
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("outdir")
+    p.add_argument("--genomes", type=int, default=10)
+    p.add_argument("--genes", type=int, default=20000,
+        help="number of genes per genome")
+    p.add_argument("--chromosomes", type=int, default=10)
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    os.makedirs(args.outdir, exist_ok=True)
+    genes = make_genomes(args.genomes, args.genes, args.chromosomes,
+        seed=args.seed)
+    write_gffs(genes, args.outdir)
+    write_orthogroups(genes, assign_families(genes, seed=args.seed),
+        os.path.join(args.outdir, "Orthogroups.tsv"))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,31 +19,66 @@ Contact: arzwa@psb.vib-ugent.be
 --------------------------------------------------------------------------------
 """
 import click
+import functools
 import logging
 import os
 import sys
-import coloredlogs
-import subprocess
-from src.orthofinder import *
-from src.gffparser import *
-from src.utils import *
-from src.adhore import *
-from src.circos import *
+from src.cache import default_cache_dir
+from src import profiling
+# NOTE: modules depending on pandas, numpy, matplotlib etc. are imported in
+# the subcommands that need them, to keep start-up fast (see
+# benchmarks/bench_startup.py)
 
 
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
 def cli():
+    import coloredlogs
     coloredlogs.install(fmt='%(asctime)s: %(levelname)s\t%(message)s',
         level="INFO", stream=sys.stdout)
     pass
 
 
+def profiled(f):
+    """
+    Add the --profile and --profile_stage options to a subcommand. The whole
+    subcommand is profiled as one stage, and the stages it marks with
+    `profiling.stage` are nested in it.
+    """
+    @click.option('--profile', is_flag=True, help='Record wall time, CPU '
+        'time and peak memory of every stage (written to profile_<command>'
+        '.json in the output directory)')
+    @click.option('--profile_stage', default=None, help='Also write cProfile '
+        'output for the stage with this name (implies --profile)')
+    @functools.wraps(f)
+    def wrapper(*args, profile=False, profile_stage=None, **kwargs):
+        if not (profile or profile_stage):
+            return f(*args, **kwargs)
+        profiling.start(f.__name__, cprofile=profile_stage)
+        try:
+            with profiling.stage(f.__name__):
+                return f(*args, **kwargs)
+        finally:
+            profiling.finish()
+    return wrapper
+
+
 @cli.command(context_settings={'help_option_names': ['-h', '--help']})
 @click.argument('data_frame', nargs=1, type=click.Path(exists=True))
 @click.argument('species', nargs=1)
 @click.argument('gff', nargs=-1, type=click.Path(exists=True))
 @click.option("--run", is_flag=True)
 @click.option("--mcl", is_flag=True)
+@click.option("--split", is_flag=True, help='Split the analysis in '
+    'within-genome and pairwise I-ADHoRe jobs (see `jobs.tsv`)')
+@click.option('--cores', '-c', default=None, type=int, help='Total number '
+    'of cores for concurrent I-ADHoRe jobs with --split (default: '
+    '--number_of_threads)')
+@click.option('--force', is_flag=True, help='Rerun all stages, also when '
+    'their inputs did not change (see `manifest.json`)')
+@click.option('--timeout', default=None, type=float, help='Kill I-ADHoRe '
+    'after this many seconds (with --run)')
+@click.option('--executable', default="i-adhore", show_default=True,
+    help='I-ADHoRe executable (with --run)')
 @click.option('--features', '-f', default="gene", show_default=True,
     type=str, help='Features to use from gff files for each species,'
     'multiple comma-separated features per species allowed.')
@@ -52,8 +87,17 @@ def cli():
     'multiple comma-separated attributes per species allowed.')
 @click.option('--outlier_filter', '-of', default=-1, show_default=True,
     help='Poisson outlier filtering threshold (< 0: no filtering)')
+@click.option('--processes', '-p', default=1, show_default=True,
+    help='Number of processes for parsing GFF files and writing gene lists')
+@click.option('--cache_dir', default=default_cache_dir(), show_default=True,
+    help='Cache directory for parsed GFF files')
+@click.option('--no_cache', is_flag=True, help='Do not use the GFF cache')
+@click.option('--clear_cache', is_flag=True, help='Clear the GFF cache first')
 @click.option('--outdir', '-o', default='py-adhore.out', show_default=True,
     help='output directory')
+@click.option('--chunksize', default=100000, show_default=True,
+    help='Number of orthogroups to process at once when writing families '
+    '(not used with --outlier_filter)')
 @click.option('--gap_size', default=30, show_default=True)
 @click.option('--cluster_gap', default=35, show_default=True)
 @click.option('--q_value', default=0.75, show_default=True)
@@ -62,12 +106,26 @@ def cli():
 @click.option('--level_2_only', default="false", show_default=True)
 @click.option('--alignment_method', default="gg2", show_default=True)
 @click.option('--number_of_threads', '-n', default=1, show_default=True)
-def of(data_frame, species, run, mcl, gff, features, attributes, outlier_filter,
-        outdir, **kwargs):
+@profiled
+def of(data_frame, species, run, mcl, split, cores, force, timeout, gff,
+        features, attributes, outlier_filter, outdir, chunksize, processes,
+        cache_dir, no_cache, clear_cache, executable, **kwargs):
     """
     Orthofinder/MCL to I-ADHoRE 3.0
+
+    When rerun with the same output directory, only the stages for which
+    the inputs or options changed are rerun (see `manifest.json`).
     """
-    import pandas as pd
+    import src.cache
+    from src.orthofinder import get_families_orthofinder, \
+        orthogroup_poisson_filter, write_families_from_df, \
+        write_families_from_mcl, read_families
+    from src.gffparser import gffs_to_genelists, write_karyotype
+    from src.utils import default_adhore_conf, parse_feat_attr, \
+        write_adhore_config
+    from src.store import write_genes_data
+    from src.manifest import load_manifest, save_manifest, up_to_date, \
+        record, file_hash, hash_key
     species = species.split(",")
     if len(species) != len(gff):
         logging.error("# of species is different from # of gff files")
@@ -76,58 +134,235 @@ def of(data_frame, species, run, mcl, gff, features, attributes, outlier_filter,
         os.mkdir(outdir)
     except FileExistsError:
         logging.warning("Output directory `{}` already exists".format(outdir))
+    profiling.set_outdir(outdir)
     conf = default_adhore_conf()
+    manifest = {} if force else load_manifest(outdir)
 
     # get features/attributes settings
     feat, attr = parse_feat_attr(features, attributes, species)
 
     # write families
-    logging.info("Writing families file")
     fn = os.path.join(outdir, "families.tsv")
-    if not mcl:
-        df = get_families_orthofinder(data_frame, species)
-        if outlier_filter > 0:
-            logging.info("Filtering Poisson outlier families (> {})".format(
-                outlier_filter))
-            df = orthogroup_poisson_filter(df, threshold=outlier_filter)
-        fn, genes = write_families_from_df(df, fn)
-    else:
-        fn, genes = write_families_from_mcl(data_frame, fn)
+    fkey = hash_key(file_hash(data_frame), species, mcl, outlier_filter)
+    with profiling.stage("families"):
+        if up_to_date(manifest, "families", fkey, [fn]):
+            fn, genes = read_families(fn)
+        elif not mcl:
+            logging.info("Writing families file")
+            if outlier_filter > 0:
+                df = get_families_orthofinder(data_frame, species)
+                logging.info("Filtering Poisson outlier families (> {})"
+                    .format(outlier_filter))
+                with profiling.stage("poisson_filter"):
+                    df = orthogroup_poisson_filter(df,
+                        threshold=outlier_filter)
+            else:
+                df = get_families_orthofinder(data_frame, species,
+                    chunksize=chunksize)
+            fn, genes = write_families_from_df(df, fn)
+        else:
+            logging.info("Writing families file")
+            fn, genes = write_families_from_mcl(data_frame, fn)
+    record(manifest, "families", fkey, [fn])
+    save_manifest(manifest, outdir)
     conf["blast_table"] = fn
 
     # write gene lists
     logging.info("Writing gene lists")
-    lconf, gdata = gffs_to_genelists(gff, feat, attr, genes, outdir)
+    if clear_cache:
+        src.cache.clear_cache(cache_dir)
+    keys = dict(manifest.get("gene_lists", {}).get("genomes", {}))
+    with profiling.stage("gene_lists"):
+        lconf, gdata = gffs_to_genelists(gff, feat, attr, genes, outdir,
+            processes=processes, cache_dir=None if no_cache else cache_dir,
+            keys=keys)
+    keys = {x["genome"]: keys[x["genome"]] for x in lconf}
+    manifest["gene_lists"] = {"genomes": keys}
+    save_manifest(manifest, outdir)
     gdfname = os.path.join(outdir, "genes_data.csv")
     if len(gdata.index) == 0:
         logging.error("No genes found, make sure the --feature and "
             "--attribute specify the correspondence between gff and families")
         exit()
-    gdata.to_csv(gdfname)
     conf["lists"] = lconf
 
-    # write karyotype
-    logging.info("Writing gene-based karyotype")
-    write_karyotype(gdata, os.path.join(outdir, "karyotype.csv"))
+    # write genes data and karyotype
+    gkey = hash_key([keys[x["genome"]] for x in lconf])
+    kfname = os.path.join(outdir, "karyotype.csv")
+    npz = os.path.join(outdir, "genes_data.npz")
+    gfiles = [gdfname, npz, kfname]
+    # the binary genes data is ignored when older than the CSV file
+    stale = all(os.path.isfile(x) for x in [gdfname, npz]) and \
+        os.path.getmtime(npz) < os.path.getmtime(gdfname)
+    if stale or not up_to_date(manifest, "genes_data", gkey, gfiles):
+        with profiling.stage("genes_data"):
+            write_genes_data(gdata, gdfname)
+            logging.info("Writing gene-based karyotype")
+            write_karyotype(gdata, kfname)
+    record(manifest, "genes_data", gkey, gfiles)
+    save_manifest(manifest, outdir)
 
     # write configuration file
     logging.info("Writing I-ADHoRe 3.0 configuration file")
     conf.update(kwargs)
     conf["output_path"] = os.path.abspath(os.path.join(outdir, "i-adhore-out"))
-    write_adhore_config(conf, os.path.join(outdir, "adhore.conf"))
+    cfname = os.path.join(outdir, "adhore.conf")
+    ckey = hash_key(conf)
+    if not up_to_date(manifest, "config", ckey, [cfname]):
+        with profiling.stage("config"):
+            write_adhore_config(conf, cfname)
+    record(manifest, "config", ckey, [cfname])
+    save_manifest(manifest, outdir)
+    if split:
+        from src.split import write_split_configs, write_manifest
+        logging.info("Writing within-genome and pairwise configuration files")
+        with profiling.stage("split_config"):
+            jobs = write_split_configs(conf, os.path.join(outdir, "jobs"))
+        jobsfile = write_manifest(jobs, os.path.join(outdir, "jobs.tsv"))
+        logging.info("Wrote {} jobs to `{}`".format(len(jobs.index), jobsfile))
 
+    # I-ADHoRe results depend on the config and on the content of its inputs
+    rkey = hash_key(ckey, fkey, gkey, split)
+    results = [os.path.join(conf["output_path"], x) for x in [
+        "segments.txt", "multiplicons.txt", "anchorpoints.txt"]] + [
+        os.path.join(outdir, "py-adhore.csv")]
+    if run and up_to_date(manifest, "i-adhore", rkey, results):
+        run = False
+    if run and split:
+        from src.adhore import run_adhore_jobs
+        cores = cores if cores else conf["number_of_threads"]
+        logs = [os.path.join(os.path.dirname(x), "i-adhore.log")
+            for x in jobs["config"]]
+        with profiling.stage("i-adhore"):
+            codes = run_adhore_jobs([(x.config, x.threads, log)
+                for x, log in zip(jobs.itertuples(), logs)], cores,
+                executable=executable)
+        failed = [i for i, c in enumerate(codes) if c != 0]
+        if failed:
+            for i in failed:
+                logging.error("I-ADHoRe failed for job `{}` (exit code {}), "
+                    "see `{}`".format(jobs["name"][i], codes[i], logs[i]))
+            logging.error("{}/{} I-ADHoRe jobs failed, not merging "
+                "results".format(len(failed), len(codes)))
+            exit(1)
+        merge_adhore(outdir)
+    elif run:
+        from src.adhore import run_adhore, summarize_adhore
+        with profiling.stage("i-adhore"):
+            m = run_adhore(os.path.join(outdir, "adhore.conf"),
+                os.path.join(outdir, "i-adhore.log"),
+                metrics=os.path.join(outdir, "run_metrics.json"),
+                timeout=timeout, executable=executable)
+        if m["exit_code"] != 0:
+            logging.error("I-ADHoRe failed, see `{}`".format(m["log"]))
+            exit(1)
+        with profiling.stage("summary"):
+            summarize_adhore(conf["output_path"], gdfname,
+                os.path.join(outdir, "py-adhore.csv"))
     if run:
-        command = ["i-adhore", os.path.join(outdir, "adhore.conf")]
-        logging.info("Running I-ADHoRe [`{}`]".format(" ".join(command)))
-        subprocess.run(command)#, capture_output=True)
-        summarize_adhore(conf["output_path"], gdfname,
-            os.path.join(outdir, "py-adhore.csv"))
+        record(manifest, "i-adhore", rkey, results)
+        save_manifest(manifest, outdir)
         logging.info("These were the parameters for I-ADHoRe: ")
         for k, v in kwargs.items():
             print("--{} '{}' ".format(k, v), end="")
         print()
 
 
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('outdir', nargs=1, type=click.Path(exists=True))
+@profiled
+def mg(outdir):
+    """
+    Merge the results of split I-ADHoRe jobs.
+
+    OUTDIR is the output directory of `of --split`, after all jobs in
+    `jobs.tsv` have been run. The merged results are written to
+    `i-adhore-out` and summarized in `py-adhore.csv` in OUTDIR.
+    """
+    profiling.set_outdir(outdir)
+    merge_adhore(outdir)
+
+
+def merge_adhore(outdir):
+    from src.split import read_manifest, merge_results
+    from src.adhore import summarize_adhore
+    jobs = read_manifest(os.path.join(outdir, "jobs.tsv"))
+    logging.info("Merging results of {} I-ADHoRe jobs".format(len(jobs.index)))
+    with profiling.stage("merge"):
+        merged = merge_results(jobs, os.path.join(outdir, "i-adhore-out"))
+    with profiling.stage("summary"):
+        summarize_adhore(merged, os.path.join(outdir, "genes_data.csv"),
+            os.path.join(outdir, "py-adhore.csv"))
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('data_frame', nargs=1, type=click.Path(exists=True))
+@click.argument('species', nargs=1)
+@click.option('--thresholds', '-t', default="1,2,3,4,5", show_default=True,
+    help='Comma-separated Poisson outlier filtering thresholds')
+@click.option('--output', '-o', default=None, help='output csv file')
+@profiled
+def pf(data_frame, species, thresholds, output):
+    """
+    Number of families retained by the Poisson outlier filter
+
+    Reports, for every threshold, the number of families retained after
+    the family-size and entry outlier filters (see `of --outlier_filter`).
+    """
+    from src.orthofinder import get_families_orthofinder, poisson_filter_sweep
+    species = species.split(",")
+    thresholds = [float(x) for x in thresholds.split(",")]
+    if output:
+        profiling.set_outdir(os.path.dirname(os.path.abspath(output)))
+    with profiling.stage("families"):
+        df = get_families_orthofinder(data_frame, species)
+    with profiling.stage("poisson_filter"):
+        sweep = poisson_filter_sweep(df, thresholds)
+    print(sweep.to_string(index=False))
+    if output:
+        sweep.to_csv(output, index=False)
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('config', nargs=1, type=click.Path(exists=True))
+@click.option('--gap_size', default=None, help='comma-separated values')
+@click.option('--cluster_gap', default=None, help='comma-separated values')
+@click.option('--q_value', default=None, help='comma-separated values')
+@click.option('--prob_cutoff', default=None, help='comma-separated values')
+@click.option('--anchor_points', default=None, help='comma-separated values')
+@click.option('--number_of_threads', '-n', default=None, type=int,
+    help='Number of threads for every I-ADHoRe job (default: from CONFIG)')
+@click.option('--cores', '-c', default=1, show_default=True,
+    help='Total number of cores to use for concurrent I-ADHoRe jobs')
+@click.option('--outdir', '-o', default=None, help='output directory '
+    '(default: `sweep` in the directory of CONFIG)')
+@click.option('--executable', default="i-adhore", show_default=True,
+    help='I-ADHoRe executable')
+@profiled
+def sw(config, number_of_threads, cores, outdir, executable, **kwargs):
+    """
+    I-ADHoRe parameter sweep.
+
+    Runs I-ADHoRe for all combinations of the given parameter values,
+    starting from the configuration file CONFIG written by `of` (so that
+    the families file and gene lists are shared by all runs). Results are
+    compared in `sweep.csv`.
+    """
+    from src.sweep import sweep
+    if not outdir:
+        outdir = os.path.join(os.path.dirname(config), "sweep")
+    try:
+        os.mkdir(outdir)
+    except FileExistsError:
+        logging.warning("Output directory `{}` already exists".format(outdir))
+    profiling.set_outdir(outdir)
+    params = {k: v.split(",") for k, v in kwargs.items() if v}
+    with profiling.stage("sweep"):
+        df = sweep(config, params, outdir, cores=cores,
+            threads=number_of_threads, executable=executable)
+    print(df.to_string())
+
+
 @cli.command(context_settings={'help_option_names': ['-h', '--help']})
 @click.argument('segments', nargs=1, type=click.Path(exists=True))
 @click.argument('genesdata', nargs=1)
@@ -139,32 +374,124 @@ def of(data_frame, species, run, mcl, gff, features, attributes, outlier_filter,
     'a syntenic block')
 @click.option('--min_order', '-mo', default=2, help='Minimum order of '
     'a multiplicon')
+@click.option('--max_chords', default=None, type=int, help='merge chords '
+    'between the same chromosomes until at most this many remain (--js)')
+@click.option('--circosjs', default=None, type=click.Path(exists=True),
+    help='local copy of circos.js to inline in the HTML (--js), so that it '
+    'can be viewed offline')
 @click.option('--outdir', '-o', default=None, help='output directory')
-def cc(segments, genesdata, all, js, minlen_kt, minlen_ch, min_order, outdir):
+@profiled
+def cc(segments, genesdata, all, js, minlen_kt, minlen_ch, min_order,
+        max_chords, circosjs, outdir):
     """
     Circos visualization of I-ADHoRe results
     """
-    import pandas as pd
+    from src.utils import segments_filter
+    from src.gffparser import write_karyotype
+    from src.circos import write_ribbons, write_circos_conf, \
+        karyotype_to_json, ribbons_table, bin_ribbons, reduce_karyotype, \
+        get_circosjs_doc
+    from src.results import Results
     if not outdir:
         outdir = os.path.join(os.path.dirname(genesdata), "circos")
     try:
         os.mkdir(outdir)
     except FileExistsError:
         logging.warning("Output directory `{}` already exists".format(outdir))
-    seg = pd.read_csv(segments, sep="\t", index_col=0)
-    seg = segments_filter(seg, min_order)
-    gdata = pd.read_csv(genesdata, index_col=0)
+    profiling.set_outdir(outdir)
+    res = Results(os.path.dirname(genesdata), genes_data=genesdata,
+        segments=segments)
+    with profiling.stage("read"):
+        seg = segments_filter(res.segments, min_order)
+        gdata = res.genes_data
     if not js:
         logging.warning("Using --js is recommended")
-        kt = write_karyotype(gdata, os.path.join(outdir, "karyotype.txt"))
-        ri = write_ribbons(seg, gdata, os.path.join(outdir, "ribbons.txt"))
-        cc = write_circos_conf(kt, ri, os.path.join(outdir, "circos.conf"))
+        with profiling.stage("circos"):
+            kt = write_karyotype(gdata, os.path.join(outdir, "karyotype.txt"))
+            ri = write_ribbons(seg, gdata, os.path.join(outdir,
+                "ribbons.txt"))
+            cc = write_circos_conf(kt, ri, os.path.join(outdir,
+                "circos.conf"))
     else:
-        kt = karyotype_to_json(gdata, minlen=minlen_kt)
-        ri = ribbons_to_json(seg, gdata, minlen=minlen_ch)
-        if not all: kt = reduce_karyotype(kt, ri)
-        get_circosjs_doc(kt, ri, os.path.join(outdir, "circos.html"),
-            [minlen_ch, minlen_kt, min_order, all, segments, genesdata])
+        with profiling.stage("ribbons"):
+            kt = karyotype_to_json(gdata, minlen=minlen_kt)
+            ri = ribbons_table(seg, gdata, minlen=minlen_ch)
+            if max_chords: ri = bin_ribbons(ri, max_chords)
+            if not all: kt = reduce_karyotype(kt, ri)
+        fname = os.path.join(outdir, "circos.html")
+        with profiling.stage("html"):
+            size = get_circosjs_doc(kt, ri, fname,
+                [minlen_ch, minlen_kt, min_order, all, segments, genesdata],
+                circosjs=circosjs)
+        logging.info("{} chords and {} chromosomes written to `{}` ({:.1f} kB)"
+            .format(len(ri.index), len(kt), fname, size / 1000))
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('segments', nargs=1, type=click.Path(exists=True))
+@click.argument('genesdata', nargs=1, type=click.Path(exists=True))
+@click.option('--genomes', '-g', default=None, help='comma-separated '
+    'genomes to render (default: all genomes in the genes data)')
+@click.option('--views', default="all", show_default=True,
+    type=click.Choice(["all", "within", "between"]),
+    help='render views of single genomes, of genome pairs or both')
+@click.option('--no_circos', is_flag=True, help='no Circos.js documents')
+@click.option('--no_dotplots', is_flag=True, help='no dot plots')
+@click.option("--all", is_flag=True)
+@click.option('--minlen_kt', '-mk', default=5e6, help='Minimum length of '
+    'genomic element')
+@click.option('--minlen_ch', '-mc', default=1e6, help='Minimum length of '
+    'a syntenic block')
+@click.option('--min_order', '-mo', default=2, help='Minimum order of '
+    'a multiplicon')
+@click.option('--minlen', default=5e5, show_default=True,
+    help='minimum chromosome length in dot plots')
+@click.option('--max_chords', default=None, type=int, help='merge chords '
+    'between the same chromosomes until at most this many remain')
+@click.option('--circosjs', default=None, type=click.Path(exists=True),
+    help='local copy of circos.js to inline in the HTML documents')
+@click.option('--processes', '-p', default=1, show_default=True,
+    help='number of processes used for rendering')
+@click.option('--outdir', '-o', default=None, help='output directory')
+@profiled
+def bv(segments, genesdata, genomes, views, no_circos, no_dotplots, all,
+        minlen_kt, minlen_ch, min_order, minlen, max_chords, circosjs,
+        processes, outdir):
+    """
+    Batch visualization of I-ADHoRe results.
+
+    Loads SEGMENTS and GENESDATA once and renders a Circos.js document and
+    a dot plot for every genome and every pair of genomes, using a pool of
+    processes that share the loaded data. An index page (index.html) links
+    all views.
+    """
+    from src.batch import load_data, render, write_index
+    from src.batch import views as get_views
+    if not outdir:
+        outdir = os.path.join(os.path.dirname(genesdata), "views")
+    os.makedirs(outdir, exist_ok=True)
+    profiling.set_outdir(outdir)
+    with profiling.stage("read"):
+        data = load_data(segments, genesdata, min_order=min_order)
+    available = sorted(set(data["gdata"]["sp"]))
+    genomes = genomes.split(",") if genomes else available
+    for g in genomes:
+        if g not in available:
+            logging.error("Genome `{}` not in genes data (available: {})"
+                .format(g, ", ".join(available)))
+            sys.exit(1)
+    v = get_views(genomes, within=views != "between",
+        between=views != "within")
+    kinds = [k for k, skip in [("circos", no_circos),
+        ("dotplot", no_dotplots)] if not skip]
+    tasks = [(k, g1, g2) for g1, g2 in v for k in kinds]
+    with profiling.stage("render"):
+        results = render(data, tasks, outdir, processes=processes,
+            minlen_kt=minlen_kt, minlen_ch=minlen_ch, all=all,
+            max_chords=max_chords, circosjs=circosjs, minlen=minlen,
+            info=[segments, genesdata])
+    index = write_index(results, os.path.join(outdir, "index.html"))
+    logging.info("{} views written, index at `{}`".format(len(results), index))
 
 
 @cli.command(context_settings={'help_option_names': ['-h', '--help']})
@@ -172,6 +499,7 @@ def cc(segments, genesdata, all, js, minlen_kt, minlen_ch, min_order, outdir):
 @click.argument('anchorpoints', nargs=1, type=click.Path(exists=True))
 @click.option('--outdir', '-o', default="clusters",
               type=click.Path(exists=False), show_default=True)
+@profiled
 def cl(genesdata, anchorpoints, outdir):
     """
     Get syntenic clusters from the syntenic network.
@@ -180,13 +508,214 @@ def cl(genesdata, anchorpoints, outdir):
     synteny networs. These are actually the subset of the orthogroups
     that are anchor pairs.
     """
-    import pandas as pd
-    import src.network
-    genesdata = pd.read_csv(genesdata, index_col=0)
-    genes, counts = src.network.get_clusters(anchorpoints, genesdata)
+    from src.results import Results
+    profiling.set_outdir(outdir)
+    res = Results(os.path.dirname(genesdata), genes_data=genesdata,
+        anchorpoints=anchorpoints)
+    with profiling.stage("read"):
+        res.genes_data
+    with profiling.stage("clusters"):
+        genes, counts = res.clusters()
     os.mkdir(outdir)
     genes.to_csv(os.path.join(outdir, "clusters.tsv"), sep="\t")
     counts.to_csv(os.path.join(outdir, "profile.csv"), sep=",")
 
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('anchorpoints', nargs=1, type=click.Path(exists=True))
+@click.argument('ks_table', nargs=1, type=click.Path(exists=True))
+@click.option('--output', '-o', default=None, help='output csv file '
+    '(default: multiplicon_ks.csv next to the anchorpoints file)')
+@click.option('--summary', '-s', default=None, type=click.Path(exists=True),
+    help='py-adhore.csv summary to which the Ks values should be added')
+@click.option('--chunksize', default=1000000, show_default=True,
+    help='Number of Ks table entries to read at once')
+@profiled
+def ks(anchorpoints, ks_table, output, summary, chunksize):
+    """
+    Median Ks of multiplicons.
+
+    Annotates the anchor pairs in ANCHORPOINTS (text file or memory-mapped
+    version, see `ap`) with Ks values from a wgd Ks table KS_TABLE and
+    writes the median Ks and number of anchor pairs for every multiplicon.
+    With --summary, these are also added to the py-adhore.csv summary (e.g.
+    for Ks-colored dot plots).
+    """
+    import pandas as pd
+    from src.ks import anchor_ks, multiplicon_ks
+    if not output:
+        output = os.path.join(os.path.dirname(anchorpoints),
+            "multiplicon_ks.csv")
+    profiling.set_outdir(os.path.dirname(os.path.abspath(output)))
+    with profiling.stage("anchor_ks"):
+        aks = anchor_ks(anchorpoints, ks_table, chunksize=chunksize)
+    with profiling.stage("multiplicon_ks"):
+        mks = multiplicon_ks(aks)
+    mks.to_csv(output)
+    logging.info("Median Ks for {} multiplicons written to `{}`".format(
+        mks["Ks"].count(), output))
+    if summary:
+        df = pd.read_csv(summary, index_col=0)
+        df = df.drop(columns=[c for c in mks.columns if c in df.columns])
+        df.join(mks, on="multiplicon").to_csv(summary)
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('anchorpoints', nargs=1, type=click.Path(exists=True))
+@click.option('--output', '-o', default=None, help='output directory '
+    '(default: anchorpoints.mmap next to the anchorpoints file)')
+@click.option('--chunksize', default=1000000, show_default=True,
+    help='Number of anchor points to read at once')
+@profiled
+def ap(anchorpoints, output, chunksize):
+    """
+    Convert anchorpoints.txt to memory-mapped arrays.
+
+    The converted anchorpoints (ANCHORPOINTS.mmap by default) are used
+    instead of the text file by the other commands (e.g. `cl`) when they
+    are not older than the text file. The directory can also be given
+    directly in place of the anchorpoints file.
+    """
+    from src.anchorpoints import convert_anchorpoints
+    profiling.set_outdir(os.path.dirname(os.path.abspath(anchorpoints)))
+    with profiling.stage("convert"):
+        convert_anchorpoints(anchorpoints, output, chunksize=chunksize)
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('genesdata', nargs=1, type=click.Path(exists=True))
+@click.argument('anchorpoints', nargs=1, type=click.Path(exists=True))
+@click.option('--genomes', '-g', required=True, help='genome (x-axis) or '
+    'comma-separated pair of genomes (x- and y-axis), as in genes_data.csv')
+@click.option('--ks', default=None, type=click.Path(exists=True),
+    help='wgd Ks table, color bins by median Ks instead of anchor counts')
+@click.option('--bins', '-b', default=500, show_default=True,
+    help='number of bins along each axis')
+@click.option('--minlen', default=500000, show_default=True,
+    help='minimum chromosome length')
+@click.option('--max_ks', default=5., show_default=True,
+    help='maximum Ks of the color scale')
+@click.option('--output', '-o', default="dotplot.png", show_default=True,
+    help='output figure')
+@click.option('--chunksize', default=1000000, show_default=True,
+    help='Number of anchor points to read at once')
+@profiled
+def dp(genesdata, anchorpoints, genomes, ks, bins, minlen, max_ks, output,
+        chunksize):
+    """
+    Density dot plot of anchor pairs.
+
+    Bins the anchor pairs in ANCHORPOINTS (text file or memory-mapped
+    version, see `ap`) for one genome or a pair of genomes in a 2D
+    histogram, drawn as a single image. The cost of rendering depends on
+    the number of bins, not on the number of anchor pairs.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from src.store import read_genes_data
+    from src.dotplot import dotplot_density
+    profiling.set_outdir(os.path.dirname(os.path.abspath(output)))
+    with profiling.stage("read"):
+        gdata = read_genes_data(genesdata)
+    g = genomes.split(",")
+    for x in g:
+        if x not in set(gdata["sp"]):
+            logging.error("Genome `{}` not in genes data (available: {})"
+                .format(x, ", ".join(sorted(set(gdata["sp"])))))
+            sys.exit(1)
+    fig, ax = plt.subplots(figsize=(10, 10))
+    with profiling.stage("density"):
+        im = dotplot_density(ax, gdata, anchorpoints, g[0], g[-1],
+            bins=bins, ks=ks, minlen=minlen, max_ks=max_ks,
+            chunksize=chunksize)
+    fig.colorbar(im, ax=ax, shrink=0.5,
+        label="median Ks" if ks else "anchor pairs")
+    with profiling.stage("render"):
+        fig.savefig(output, dpi=200, bbox_inches="tight")
+    logging.info("Dot plot written to `{}`".format(output))
+
+
+def parse_regions(ctx, param, value):
+    # `(region, chrom, start, stop)` for every --region
+    if not value:
+        return value
+    from src.intervals import parse_region
+    try:
+        return [(r,) + parse_region(r) for r in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@cli.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.argument('outdir', nargs=1, type=click.Path(exists=True))
+@click.option('--region', '-r', multiple=True, callback=parse_regions,
+    help='region as chrom:start-stop (1-based, closed) or chromosome, can be '
+    'repeated')
+@click.option('--gene', '-g', multiple=True, help='gene to get the '
+    'syntenic partners of, can be repeated')
+@click.option('--bed', '-b', default=None, type=click.Path(exists=True),
+    help='BED file with regions to query')
+@click.option('--type', '-t', 'kind', default="segments", show_default=True,
+    type=click.Choice(["genes", "segments", "anchors"]),
+    help='results to print')
+@click.option('--output', '-o', default=None, help='write all results to '
+    '<output>_genes.tsv, <output>_segments.tsv and <output>_anchors.tsv '
+    'instead of printing them')
+@click.option('--index', default=None, help='index file (default: '
+    'query_index.npz in OUTDIR)')
+@click.option('--save_index', is_flag=True, help='save the index for reuse '
+    'by later queries')
+@profiled
+def query(outdir, region, gene, bed, kind, output, index, save_index):
+    """
+    Query I-ADHoRe results by genomic region or gene.
+
+    Reports the genes, segments (with their multiplicon) and anchor points
+    overlapping regions, or the anchor points, partner genes and segments
+    of genes, for the py-adhore output directory OUTDIR. Regions are looked
+    up in an interval index, which is saved with --save_index and then
+    reused as long as it is not older than the I-ADHoRe results.
+    """
+    import pandas as pd
+    from src.results import Results
+    from src.intervals import read_bed
+    index = index if index else os.path.join(outdir, "query_index.npz")
+    profiling.set_outdir(outdir)
+    res = Results(outdir)
+    with profiling.stage("index"):
+        idx = res.intervals(index)
+    if save_index:
+        logging.info("Index saved to `{}`".format(idx.save(index)))
+    if not (region or gene or bed):
+        if not save_index:
+            logging.error("Nothing to query, use --region, --gene or --bed")
+            sys.exit(1)
+        return
+    results = []
+    with profiling.stage("query"):
+        if region:
+            names, c, s, e = zip(*region)
+            results.append(idx.regions(c, s, e, names=list(names)))
+        if bed:
+            try:
+                c, s, e, names = read_bed(bed)
+            except ValueError as err:
+                logging.error(err)
+                sys.exit(1)
+            results.append(idx.regions(c, s, e, names=names))
+        if gene:
+            results.append(idx.genes(list(gene)))
+    results = {k: pd.concat([r[k] for r in results], ignore_index=True)
+        for k in ["genes", "segments", "anchors"]}
+    if output:
+        for k, df in results.items():
+            fname = "{}_{}.tsv".format(output, k)
+            df.to_csv(fname, sep="\t", index=False)
+            logging.info("{} {} written to `{}`".format(len(df.index), k,
+                fname))
+    else:
+        results[kind].to_csv(sys.stdout, sep="\t", index=False)
+
 if __name__ == '__main__':
     cli()
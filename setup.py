@@ -19,8 +19,7 @@ setup(
         'coloredlogs>=10.0',
         'numpy>=1.16',
         'matplotlib>=3.0.2',
-        'pandas==0.24.1',
-        'gffutils==0.10.1'
+        'pandas==0.24.1'
     ],
     entry_points='''
         [console_scripts]
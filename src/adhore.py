@@ -1,19 +1,269 @@
 import pandas as pd
+import numpy as np
+import json
+import logging
 import os
+import re
+import subprocess
+import threading
+import time
+from src.store import read_genes_data
+from src.anchorpoints import anchorpoint_chunks
+from src.profiling import peak_rss, children_rusage, children_peak_rss
 
 
 # Parse files produced by I-ADHoRe
-def summarize_adhore(outdir, gdata, fname):
+def summarize_adhore(outdir, gdata, fname, anchors=None):
     """
-    Make a one file summary of the I-ADHoRe results. One syntenic block per row
-    with a multiplicon ID, anchor points, start coordinate and stop coordinate.
-    (Maybe also coordinate for each anchor within the segment. Also each anchor
-    point should have an id corresponding to its anchor pairs.)
+    Make a one file summary of the I-ADHoRe results. One syntenic block
+    (segment) per row with a multiplicon ID, the multiplicon level, start and
+    stop coordinate, length (bp), number of genes, number of anchor points
+    and the coordinates of the first and last anchor point in the segment.
+    If `anchors` is given, the coordinate of every anchor point in every
+    segment is written to that file, with the anchor point ID (so that
+    anchor pairs can be matched).
+
+    Anchor points are read in chunks, so that this scales to very large
+    anchorpoints files.
     """
     seg = pd.read_csv(
         os.path.join(outdir, "segments.txt"), sep="\t", index_col=0)
-    gd = pd.read_csv(gdata, index_col=0)
-    seg["start"] = list(gd.loc[seg["first"]]["start"])
-    seg["stop"] = list(gd.loc[seg["last"]]["stop"])
+    mp = pd.read_csv(os.path.join(outdir, "multiplicons.txt"), sep="\t",
+        index_col=0, usecols=["id", "level"])
+    gd = read_genes_data(gdata)
+    gd = gene_ranks(gd)
+    seg = seg.join(gd[["start", "rank"]], on="first")
+    seg = seg.join(gd[["stop", "rank"]], on="last", rsuffix="_last")
     seg["length"] = seg["stop"] - seg["start"]
+    seg["genes"] = seg["rank_last"] - seg["rank"] + 1
+    seg = seg.join(mp["level"], on="multiplicon")
+    stats = segment_anchors(seg, gd, os.path.join(outdir, "anchorpoints.txt"),
+        anchors)
+    seg = seg.join(stats)
+    seg["anchors"] = seg["anchors"].fillna(0).astype(int)
+    for col in ["anchor_start", "anchor_stop"]:
+        seg[col] = seg[col].astype("Int64")
+    seg = seg.drop(columns=["rank", "rank_last"])
     seg.to_csv(fname)
+    return os.path.abspath(fname)
+
+
+def gene_ranks(gd):
+    """
+    Make sure the genes data has the rank of every gene in its gene list
+    (`rank`, recorded by `write_gene_lists`). For genes data written before
+    ranks were recorded, the order of the genes data within every genome and
+    chromosome is used, which is the gene list order.
+    """
+    if "rank" in gd.columns:
+        return gd
+    gd = gd.copy()
+    gd["rank"] = gd.groupby([gd["sp"].astype(str).values,
+        gd["chrom"].astype(str).values], sort=False).cumcount().values
+    return gd
+
+
+def segment_anchors(seg, gd, anchorpoints, anchors=None):
+    """
+    Get the number of anchor points and the coordinates of the first and
+    last anchor point for every segment. An anchor gene belongs to a segment
+    of its multiplicon when it is on the same genome and list and between
+    the first and last gene of the segment.
+    """
+    segs = seg[["multiplicon", "genome", "list", "rank", "rank_last"]].copy()
+    segs["segment"] = segs.index
+    segs["genome"] = segs["genome"].astype(str)
+    segs["list"] = segs["list"].astype(str)
+    sp = gd["sp"].astype(str).values
+    chrom = gd["chrom"].astype(str).values
+    stats = []
+    header = True
+    for ap in anchorpoint_chunks(anchorpoints, ["id", "multiplicon",
+            "gene_x", "gene_y"]):
+        df = pd.DataFrame({
+            "anchor": np.concatenate([ap["id"].values, ap["id"].values]),
+            "multiplicon": np.concatenate([ap["multiplicon"].values] * 2),
+            "gene": np.concatenate([ap["gene_x"].values,
+                ap["gene_y"].values])})
+        pos = gd.index.get_indexer(df["gene"])
+        df, pos = df[pos >= 0], pos[pos >= 0]
+        df["genome"], df["list"] = sp[pos], chrom[pos]
+        df["start"] = gd["start"].values[pos]
+        df["stop"] = gd["stop"].values[pos]
+        df["r"] = gd["rank"].values[pos]
+        df = df.merge(segs, on=["multiplicon", "genome", "list"])
+        df = df[(df["r"] >= df["rank"]) & (df["r"] <= df["rank_last"])]
+        if anchors:
+            df[["anchor", "segment", "multiplicon", "gene", "start",
+                "stop"]].to_csv(anchors, mode="w" if header else "a",
+                header=header, index=False)
+            header = False
+        g = df.groupby("segment")
+        stats.append(pd.DataFrame({"anchors": g.size(),
+            "anchor_start": g["start"].min(), "anchor_stop": g["stop"].max()}))
+    if len(stats) == 0:
+        return pd.DataFrame(columns=["anchors", "anchor_start", "anchor_stop"])
+    stats = pd.concat(stats)
+    g = stats.groupby(level=0)
+    return pd.DataFrame({"anchors": g["anchors"].sum(),
+        "anchor_start": g["anchor_start"].min(),
+        "anchor_stop": g["anchor_stop"].max()})
+
+
+def count_results(outdir):
+    """
+    Count the number of multiplicons, segments and anchor points in an
+    I-ADHoRe output directory (number of lines, without parsing the files).
+    """
+    counts = {}
+    for k in ["multiplicons", "segments", "anchorpoints"]:
+        fn = os.path.join(outdir, k + ".txt")
+        if not os.path.isfile(fn):
+            counts[k] = None
+            continue
+        with open(fn, "r") as f:
+            counts[k] = max(sum(1 for line in f if line.strip()) - 1, 0)
+    return counts
+
+
+# exit code for runs of which the executable could not be started, as in sh
+NOT_RUN = 127
+
+
+def run_adhore_jobs(jobs, cores=1, poll=1, executable="i-adhore"):
+    """
+    Run I-ADHoRe jobs concurrently such that the total number of threads of
+    the running jobs does not exceed `cores` (a job that needs more threads
+    than `cores` is run alone). `jobs` is a list of `(config, threads, log)`
+    tuples, returns the list of exit codes (`NOT_RUN` for jobs for which the
+    executable could not be started).
+    """
+    pending = list(enumerate(jobs))
+    running = []
+    codes = [None] * len(jobs)
+    while pending or running:
+        used = sum(x[2] for x in running)
+        while pending:
+            i, (conf, threads, log) = pending[0]
+            if running and used + threads > cores:
+                break
+            pending.pop(0)
+            logging.info("Running I-ADHoRe [`{} {}`]".format(executable,
+                conf))
+            with open(log, "w") as f:
+                try:
+                    p = subprocess.Popen([executable, conf], stdout=f,
+                        stderr=subprocess.STDOUT)
+                except OSError as e:
+                    logging.error("Could not run I-ADHoRe executable `{}` "
+                        "for {}: {}".format(executable, conf, e))
+                    f.write("Could not run `{}`: {}\n".format(executable, e))
+                    codes[i] = NOT_RUN
+                    continue
+            running.append((i, p, threads))
+            used += threads
+        time.sleep(poll)
+        for job in [x for x in running if x[1].poll() is not None]:
+            i, p, threads = job
+            codes[i] = p.returncode
+            if p.returncode != 0:
+                logging.warning("I-ADHoRe failed for {} (exit code {}), see "
+                    "{}".format(jobs[i][0], p.returncode, jobs[i][2]))
+            running.remove(job)
+    return codes
+
+
+PROGRESS = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+
+
+def run_adhore(conf, log, metrics=None, timeout=None, executable="i-adhore",
+        poll=0.5):
+    """
+    Run I-ADHoRe (the `executable`) for the configuration file `conf`,
+    streaming its stdout and stderr to `log` and logging progress lines
+    (lines with a percentage). The run is killed after `timeout` seconds.
+    Wall time, CPU time and peak RSS of the child process are returned (and
+    written as JSON to `metrics`). If the executable can not be started, the
+    exit code is `NOT_RUN`.
+    """
+    command = [executable, conf]
+    logging.info("Running I-ADHoRe [`{}`]".format(" ".join(command)))
+    t0 = time.perf_counter()
+    start = time.strftime("%Y-%m-%dT%H:%M:%S")
+    r0 = children_rusage()
+    try:
+        p = subprocess.Popen(command, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, bufsize=1)
+    except OSError as e:
+        logging.error("Could not run I-ADHoRe executable `{}`: {}".format(
+            executable, e))
+        with open(log, "w") as f:
+            f.write("Could not run `{}`: {}\n".format(executable, e))
+        m = {"command": command, "start": start, "exit_code": NOT_RUN,
+            "timed_out": False, "wall_time": time.perf_counter() - t0,
+            "user_time": None, "system_time": None, "cpu_time": None,
+            "peak_rss_mb": None, "log": os.path.abspath(log)}
+        if metrics:
+            with open(metrics, "w") as f:
+                json.dump(m, f, indent=2)
+        return m
+    lock = threading.Lock()
+    with open(log, "w") as f:
+        readers = [threading.Thread(target=_stream, args=(p.stdout, f, lock,
+            "")), threading.Thread(target=_stream, args=(p.stderr, f, lock,
+            "[stderr] "))]
+        for r in readers:
+            r.start()
+        timed_out = False
+        peak = 0
+        while True:
+            peak = max(peak, peak_rss(p.pid) or 0)
+            try:
+                p.wait(poll)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if timeout and time.perf_counter() - t0 > timeout:
+                logging.error("I-ADHoRe timed out after {} s, killing "
+                    "it".format(timeout))
+                p.kill()
+                timed_out = True
+                p.wait()
+                break
+        for r in readers:
+            r.join()
+    wall = time.perf_counter() - t0
+    # without /proc, fall back to the peak RSS of the largest child so far
+    r1 = children_rusage()
+    user, system = (r1.ru_utime - r0.ru_utime, r1.ru_stime - r0.ru_stime) \
+        if r1 else (None, None)
+    peak = peak if peak > 0 else children_peak_rss()
+    m = {"command": command, "start": start, "exit_code": p.returncode,
+        "timed_out": timed_out, "wall_time": wall,
+        "user_time": user, "system_time": system,
+        "cpu_time": user + system if r1 else None,
+        "peak_rss_mb": peak / 1024 if peak else None,
+        "log": os.path.abspath(log)}
+    logging.info("I-ADHoRe finished (exit code {}) in {:.1f} s wall time, "
+        "{} s CPU time, peak RSS {} MB".format(p.returncode, wall,
+        _fmt(m["cpu_time"]), _fmt(m["peak_rss_mb"])))
+    if metrics:
+        with open(metrics, "w") as f:
+            json.dump(m, f, indent=2)
+    return m
+
+
+def _fmt(x):
+    return "-" if x is None else "{:.1f}".format(x)
+
+
+def _stream(pipe, f, lock, prefix):
+    # copy lines from a child's pipe to the log file, logging progress
+    for line in pipe:
+        with lock:
+            f.write(prefix + line)
+            f.flush()
+        match = PROGRESS.search(line)
+        if match and not prefix:
+            logging.info("I-ADHoRe: {}".format(line.strip()))
+    pipe.close()
@@ -0,0 +1,189 @@
+"""
+Reading the (potentially very large) I-ADHoRe `anchorpoints.txt` file. The
+file is read in typed chunks, keeping only the columns of interest, and can be
+converted once into a directory of memory-mapped `.npy` arrays (one per
+column, genes encoded as integer codes into a gene array), which is used
+instead of the text file when it is not older than it.
+
+    anchorpoints.mmap/
+        id.npy multiplicon.npy basecluster.npy coord_x.npy coord_y.npy
+        gene_x.npy gene_y.npy genes.npy
+"""
+import logging
+import numpy as np
+import pandas as pd
+import os
+
+ANCHOR_COLUMNS = ["id", "multiplicon", "basecluster", "gene_x", "gene_y",
+    "coord_x", "coord_y"]
+ANCHOR_DTYPES = {"id": np.int64, "multiplicon": np.int32,
+    "basecluster": np.int32, "gene_x": str, "gene_y": str,
+    "coord_x": np.int32, "coord_y": np.int32}
+CHUNKSIZE = 1000000
+
+
+def binary_path(fname):
+    return os.path.splitext(fname)[0] + ".mmap"
+
+
+def _binary(fname):
+    # the memory-mapped version to use for `fname`, if any
+    if os.path.isdir(fname):
+        return fname
+    path = binary_path(fname)
+    if os.path.isdir(path) and os.path.getmtime(path) >= os.path.getmtime(
+            fname):
+        if _complete(path):
+            return path
+        logging.warning("`{}` was written by an older version, using `{}` "
+            "instead (rerun `py-adhore ap` to update it)".format(path, fname))
+    return None
+
+
+def _complete(path):
+    # whether all columns are in the memory-mapped version
+    return all(os.path.isfile(os.path.join(path, c + ".npy"))
+        for c in ANCHOR_COLUMNS + ["genes"])
+
+
+def anchorpoint_chunks(fname, columns=ANCHOR_COLUMNS, chunksize=CHUNKSIZE):
+    """
+    Iterate over the anchorpoints (text file or its memory-mapped version)
+    in chunks, as data frames with typed `columns`.
+    """
+    path = _binary(fname)
+    if path:
+        return _binary_chunks(open_anchorpoints(path), columns, chunksize)
+    dtype = {c: ANCHOR_DTYPES[c] for c in columns}
+    return pd.read_csv(fname, sep="\t", usecols=columns, dtype=dtype,
+        chunksize=chunksize)
+
+
+def _binary_chunks(ap, columns, chunksize):
+    n = len(ap["multiplicon"])
+    for i in range(0, n, chunksize):
+        yield pd.DataFrame({c: ap["genes"][ap[c][i:i+chunksize]] if c in
+            ["gene_x", "gene_y"] else np.asarray(ap[c][i:i+chunksize])
+            for c in columns}, columns=columns)
+
+
+def read_anchorpoints(fname, columns=ANCHOR_COLUMNS, chunksize=CHUNKSIZE):
+    """
+    Read the anchorpoints (text file or its memory-mapped version) in a data
+    frame with typed `columns`, where genes are categorical.
+    """
+    path = _binary(fname)
+    if path:
+        ap = open_anchorpoints(path)
+        df = pd.DataFrame({c: ap[c] if c not in ["gene_x", "gene_y"] else
+            pd.Categorical.from_codes(ap[c], categories=ap["genes"])
+            for c in columns}, columns=columns)
+        return df
+    codes = GeneCodes()
+    chunks = []
+    for df in anchorpoint_chunks(fname, columns, chunksize):
+        for c in ["gene_x", "gene_y"]:
+            if c in columns:
+                df[c] = codes.encode(df[c])
+        chunks.append(df)
+    if len(chunks) == 0:
+        chunks = [pd.DataFrame({c: np.array([], dtype=np.int64) if c in [
+            "gene_x", "gene_y"] else np.array([], dtype=ANCHOR_DTYPES[c])
+            for c in columns}, columns=columns)]
+    df = pd.concat(chunks, ignore_index=True)
+    for c in ["gene_x", "gene_y"]:
+        if c in columns:
+            df[c] = pd.Categorical.from_codes(df[c], categories=codes.genes())
+    return df
+
+
+def gene_pairs(fname, chunksize=CHUNKSIZE):
+    """
+    Get the anchor pairs as integer codes `(x, y, genes)`, where `genes[x[i]]`
+    and `genes[y[i]]` are the genes of the i-th anchor pair.
+    """
+    path = _binary(fname)
+    if path:
+        ap = open_anchorpoints(path)
+        return ap["gene_x"], ap["gene_y"], ap["genes"]
+    codes = GeneCodes()
+    x, y = [], []
+    for df in anchorpoint_chunks(fname, ["gene_x", "gene_y"], chunksize):
+        x.append(codes.encode(df["gene_x"]))
+        y.append(codes.encode(df["gene_y"]))
+    x = np.concatenate(x) if x else np.array([], dtype=np.int64)
+    y = np.concatenate(y) if y else np.array([], dtype=np.int64)
+    return x, y, codes.genes()
+
+
+class GeneCodes():
+    """
+    Incremental integer encoding of gene IDs over chunks.
+    """
+    def __init__(self):
+        self.index = {}
+
+    def encode(self, genes):
+        codes = genes.map(self.index)
+        new = pd.unique(genes[codes.isnull()])
+        if len(new) > 0:
+            n = len(self.index)
+            self.index.update(zip(new, range(n, n + len(new))))
+            codes = genes.map(self.index)
+        return codes.values.astype(np.int64)
+
+    def genes(self):
+        return np.array(list(self.index.keys()), dtype=str)
+
+
+def convert_anchorpoints(fname, path=None, chunksize=CHUNKSIZE):
+    """
+    Convert the anchorpoints text file to a directory of memory-mapped
+    arrays, reading the text file in chunks.
+    """
+    path = path if path else binary_path(fname)
+    with open(fname, "r") as f:
+        n = sum(1 for line in f if line.strip()) - 1
+    tmp = path + ".{}.tmp".format(os.getpid())
+    os.makedirs(tmp)
+    arrays = {}
+    for c in ANCHOR_COLUMNS:
+        dtype = np.int32 if c in ["gene_x", "gene_y"] else ANCHOR_DTYPES[c]
+        arrays[c] = np.lib.format.open_memmap(os.path.join(
+            tmp, c + ".npy"), mode="w+", dtype=dtype, shape=(max(n, 0),))
+    codes = GeneCodes()
+    i = 0
+    for df in anchorpoint_chunks(fname, ANCHOR_COLUMNS, chunksize):
+        j = i + len(df.index)
+        for c in ANCHOR_COLUMNS:
+            if c in ["gene_x", "gene_y"]:
+                arrays[c][i:j] = codes.encode(df[c])
+            else:
+                arrays[c][i:j] = df[c].values
+        i = j
+    for a in arrays.values():
+        a.flush()
+    np.save(os.path.join(tmp, "genes.npy"), codes.genes())
+    del arrays
+    if os.path.isdir(path):
+        logging.warning("Overwriting `{}`".format(path))
+        for fn in os.listdir(path):
+            os.remove(os.path.join(path, fn))
+        os.rmdir(path)
+    os.rename(tmp, path)
+    logging.info("Wrote {} anchor points to `{}`".format(i, path))
+    return os.path.abspath(path)
+
+
+def open_anchorpoints(path):
+    """
+    Open the memory-mapped anchorpoints, returns a dictionary of arrays
+    (genes as codes into the `genes` array).
+    """
+    if not _complete(path):
+        raise ValueError("`{}` was written by an older version and lacks "
+            "columns, rerun `py-adhore ap` to update it".format(path))
+    ap = {c: np.load(os.path.join(path, c + ".npy"), mmap_mode="r")
+        for c in ANCHOR_COLUMNS}
+    ap["genes"] = np.load(os.path.join(path, "genes.npy"))
+    return ap
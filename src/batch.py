@@ -0,0 +1,159 @@
+"""
+Batch rendering of Circos.js documents and dot plots for many genomes and
+genome pairs. The segments and genes data are loaded once, and shared with
+the worker processes of a process pool: where available, the pool is forked
+after loading the data, so that the workers read the parent's (copy-on-write)
+memory instead of receiving a pickled copy.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+from src.utils import segments_filter
+from src.results import Results
+
+_data = {}
+
+
+def load_data(segments, genesdata, min_order=2):
+    """
+    Load the segments (filtered on multiplicon order, see `segments_filter`)
+    and genes data, and derive the segment coordinates used by `dotplot` and
+    the karyotype.
+    """
+    res = Results(os.path.dirname(genesdata), genes_data=genesdata,
+        segments=segments)
+    seg = segments_filter(res.segments, min_order)
+    gdata = res.genes_data
+    df = seg[["multiplicon", "genome", "list", "first", "last"]]
+    df = df.join(gdata["start"], on="first").join(gdata["stop"], on="last")
+    df = df.dropna(subset=["start", "stop"])
+    return {"segments": seg, "gdata": gdata, "summary": df,
+        "kt": res.karyotype,
+        "min_order": min_order}
+
+
+def views(genomes, within=True, between=True):
+    """
+    All views (a genome, or a pair of genomes) to render.
+    """
+    v = [(g, g) for g in genomes] if within else []
+    if between:
+        v += list(itertools.combinations(genomes, 2))
+    return v
+
+
+def render(data, tasks, outdir, processes=1, **kwargs):
+    """
+    Render all `tasks` (`(kind, g1, g2)` with kind `circos` or `dotplot`) to
+    files in `outdir`, using a pool of `processes` workers. Keyword
+    arguments are passed on to `render_circos` and `render_dotplot`. Returns
+    the tasks with the file names, in the order of `tasks`.
+    """
+    global _data
+    args = [(task, outdir, kwargs) for task in tasks]
+    if processes > 1 and len(tasks) > 1:
+        processes = min(processes, len(tasks))
+        logging.info("Rendering {} views using {} processes".format(
+            len(tasks), processes))
+        if "fork" in multiprocessing.get_all_start_methods():
+            _data = data
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                files = pool.map(_render, args)
+        else:
+            with multiprocessing.Pool(processes, initializer=_init_worker,
+                    initargs=(data,)) as pool:
+                files = pool.map(_render, args)
+    else:
+        _data = data
+        files = [_render(x) for x in args]
+    return [(t, f) for t, f in zip(tasks, files)]
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _render(args):
+    (kind, g1, g2), outdir, kwargs = args
+    if kind == "circos":
+        return render_circos(_data, g1, g2, outdir, **kwargs)
+    return render_dotplot(_data, g1, g2, outdir, **kwargs)
+
+
+def view_name(g1, g2):
+    return g1 if g1 == g2 else "{}-{}".format(g1, g2)
+
+
+def render_circos(data, g1, g2, outdir, minlen_kt=5e6, minlen_ch=1e6,
+        all=False, max_chords=None, circosjs=None, info=None, **kwargs):
+    """
+    Circos.js document for the chords within genome `g1` (if `g1 == g2`), or
+    between genomes `g1` and `g2`.
+    """
+    from src.circos import karyotype_to_json, ribbons_table, bin_ribbons, \
+        reduce_karyotype, get_circosjs_doc
+    seg, gdata, kt = data["segments"], data["gdata"], data["kt"]
+    seg = seg[seg["genome"].isin([g1, g2])]
+    ri = ribbons_table(seg, gdata, minlen=minlen_ch)
+    if g1 != g2:
+        # only chords between the two genomes
+        sp = kt["sp"]
+        ri = ri[sp.loc[ri["chrom_x"]].values != sp.loc[ri["chrom_y"]].values]
+    if max_chords: ri = bin_ribbons(ri, max_chords)
+    kt = [x for x in karyotype_to_json(gdata, minlen=minlen_kt)
+        if x["label"] in (g1, g2)]
+    if not all: kt = reduce_karyotype(kt, ri)
+    fname = os.path.join(outdir, "circos_{}.html".format(view_name(g1, g2)))
+    size = get_circosjs_doc(kt, ri, fname, [minlen_ch, minlen_kt,
+        data.get("min_order", 2), all] + list(info or ["segments",
+        "genes data"]), circosjs=circosjs)
+    logging.info("{} chords written to `{}` ({:.1f} kB)".format(
+        len(ri.index), fname, size / 1000))
+    return fname
+
+
+def render_dotplot(data, g1, g2, outdir, minlen=500000, linewidth=2,
+        **kwargs):
+    """
+    Dot plot of the segments for genome `g1` (x-axis) and `g2` (y-axis).
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from src.dotplot import dotplot
+    fig, ax = plt.subplots(figsize=(10, 10))
+    dotplot(ax, data["kt"], data["summary"], g1, g2, minlen=minlen,
+        linewidth=linewidth)
+    fname = os.path.join(outdir, "dotplot_{}.png".format(view_name(g1, g2)))
+    fig.savefig(fname, dpi=200, bbox_inches="tight")
+    plt.close(fig)
+    logging.info("Dot plot written to `{}`".format(fname))
+    return fname
+
+
+def write_index(results, fname):
+    """
+    Write an HTML page linking all rendered views, one row per view.
+    """
+    rows = {}
+    for (kind, g1, g2), f in results:
+        rows.setdefault((g1, g2), {})[kind] = os.path.relpath(f,
+            os.path.dirname(os.path.abspath(fname)))
+    html = "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+    html += "<title>py-adhore</title></head><body><table>"
+    html += "<tr><th>view</th><th>Circos.js</th><th>dot plot</th></tr>"
+    for (g1, g2), files in rows.items():
+        html += "<tr><td>{}</td>".format(
+            g1 if g1 == g2 else "{} vs. {}".format(g1, g2))
+        c = files.get("circos")
+        html += "<td>{}</td>".format(
+            "<a href='{0}'>{0}</a>".format(c) if c else "")
+        d = files.get("dotplot")
+        html += "<td>{}</td></tr>".format("<a href='{0}'><img src='{0}' "
+            "width='200'></a>".format(d) if d else "")
+    html += "</table></body></html>"
+    with open(fname, "w") as f:
+        f.write(html)
+    return os.path.abspath(fname)
@@ -0,0 +1,63 @@
+"""
+Persistent on-disk cache for parsed GFF files. Entries are keyed by the GFF
+file path, its size and modification time and the features and attribute
+used, and stored with `src.store`. Old entries are evicted by age and total
+cache size (least recently used first).
+"""
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+MAX_CACHE_SIZE = 2 * 1024**3  # bytes
+MAX_CACHE_AGE = 30  # days
+
+
+def default_cache_dir():
+    if "PYADHORE_CACHE" in os.environ:
+        return os.environ["PYADHORE_CACHE"]
+    base = os.environ.get("XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "py-adhore")
+
+
+def cache_key(fname, features, attr):
+    st = os.stat(fname)
+    key = "\t".join([os.path.realpath(fname), str(st.st_size),
+        str(st.st_mtime_ns), ";".join(features), attr])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def cache_path(cache_dir, fname, features, attr):
+    return os.path.join(cache_dir, "{}.{}.npz".format(
+        os.path.basename(fname), cache_key(fname, features, attr)))
+
+
+def evict(cache_dir, max_size=MAX_CACHE_SIZE, max_age=MAX_CACHE_AGE):
+    """
+    Remove cache entries older than `max_age` days, and then the least
+    recently used entries until the cache is smaller than `max_size` bytes.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for fn in os.listdir(cache_dir):
+        if fn.endswith(".npz"):
+            p = os.path.join(cache_dir, fn)
+            st = os.stat(p)
+            entries.append((st.st_mtime, st.st_size, p))
+    entries.sort()
+    now = time.time()
+    total = sum(x[1] for x in entries)
+    for mtime, size, p in entries:
+        if now - mtime > max_age * 86400 or total > max_size:
+            logging.debug("Evicting cache entry {}".format(p))
+            os.remove(p)
+            total -= size
+
+
+def clear_cache(cache_dir):
+    if os.path.isdir(cache_dir):
+        logging.info("Clearing cache `{}`".format(cache_dir))
+        shutil.rmtree(cache_dir)
@@ -1,14 +1,15 @@
 # Tools for getting Circos visualizations from I-ADHoRe output
 import pandas as pd
+import numpy as np
+import logging
+import json
 import os
-import matplotlib
-import random
 pd.set_option('mode.chained_assignment', None)
 
 
 def write_karyotype_circos(gdata, fname):
     colors = ["green", "blue", "orange"]
-    df = gdata.groupby(["chrom"])[["stop", "sp"]].max()
+    df = gdata.groupby(["chrom"], observed=True)[["stop", "sp"]].max()
     df["start"] = 0
     df["chrom"] = df["label"] = df.index
     df["color"] = colors[0]
@@ -22,28 +23,53 @@ def write_karyotype_circos(gdata, fname):
 
 
 def write_ribbons(seg, gdata, fname):
-    d = seg.groupby("multiplicon")["first"].apply(list)
-    e = seg.groupby("multiplicon")["last"].apply(list)
-    df = pd.concat([d, e], axis=1)
-    lines = []
-    for mp in df.index:
-        n = len(df.loc[mp]["first"])
-        for i in range(n):
-            gdata.loc[df.loc[mp]["first"][i]]
-            c1 = gdata.loc[df.loc[mp]["first"][i]]["chrom"]
-            x1 = gdata.loc[df.loc[mp]["first"][i]]["start"]
-            x2 = gdata.loc[df.loc[mp]["last"][i]]["stop"]
-            for j in range(i, n):
-                c2 = gdata.loc[df.loc[mp]["first"][j]]["chrom"]
-                y1 = gdata.loc[df.loc[mp]["first"][j]]["start"]
-                y2 = gdata.loc[df.loc[mp]["last"][j]]["stop"]
-                lines.append(" ".join([str(x) for x in
-                    [c1, x1, x2, c2, y1, y2]]))
+    df = segment_pairs(seg, gdata, self_pairs=True)
+    cols = df[["chrom_x", "start_x", "stop_x", "chrom_y", "start_y",
+        "stop_y"]].astype(str)
+    lines = cols["chrom_x"].str.cat([cols[c] for c in cols.columns[1:]],
+        sep=" ")
     with open(fname, "w") as f:
         f.write("\n".join(lines))
     return os.path.abspath(fname)
 
 
+def segment_coordinates(seg, gdata):
+    """
+    Get the species, chromosome, start and stop coordinate for every segment
+    by joining the segments with the genes data (first and last gene).
+    """
+    df = seg[["multiplicon", "first", "last"]]
+    df = df.join(gdata[["sp", "chrom", "start"]], on="first")
+    df = df.join(gdata["stop"], on="last")
+    n = len(df.index)
+    df = df.dropna(subset=["chrom", "start", "stop"])
+    if len(df.index) < n:
+        logging.warning("{} segments with genes not in genes data".format(
+            n - len(df.index)))
+    df["start"] = df["start"].astype(np.int64)
+    df["stop"] = df["stop"].astype(np.int64)
+    return df.drop(columns=["first", "last"])
+
+
+def segment_pairs(seg, gdata, minlen=0, self_pairs=False):
+    """
+    Get all pairs of segments within each multiplicon, with the coordinates
+    of both segments (suffixes `_x` and `_y`). Pairs are ordered by
+    multiplicon and the order of the segments within the multiplicon. Only
+    pairs for which the first segment is at least `minlen` long are retained.
+    """
+    df = segment_coordinates(seg, gdata)
+    df = df.sort_values("multiplicon", kind="mergesort")
+    df["k"] = np.arange(len(df.index))
+    x = df[df["stop"] - df["start"] >= minlen]
+    pairs = x.merge(df, on="multiplicon")
+    if self_pairs:
+        pairs = pairs[pairs["k_x"] <= pairs["k_y"]]
+    else:
+        pairs = pairs[pairs["k_x"] < pairs["k_y"]]
+    return pairs.drop(columns=["k_x", "k_y"]).reset_index(drop=True)
+
+
 def write_circos_conf(karyotype, ribbons, fname):
     conf_str = """
     <<include etc/colors_fonts_patterns.conf>>
@@ -69,50 +95,103 @@ def write_circos_conf(karyotype, ribbons, fname):
     return os.path.abspath(fname)
 
 
-def ribbons_to_json(seg, gdata, minlen=1e6):
-    json_list = []
-    d = seg.groupby("multiplicon")["first"].apply(list)
-    e = seg.groupby("multiplicon")["last"].apply(list)
-    df = pd.concat([d, e], axis=1)
+RIBBON_COLUMNS = ["chrom_x", "start_x", "stop_x", "chrom_y", "start_y",
+    "stop_y", "value"]
+
+
+def ribbons_table(seg, gdata, minlen=1e6):
+    """
+    Chords (one row per pair of segments in a multiplicon) as a data frame
+    with columns `RIBBON_COLUMNS`, `value` being the color index for the
+    species pair.
+    """
+    df = segment_pairs(seg, gdata, minlen=minlen)
     ch_colors = get_chord_colors(list(gdata["sp"].unique()))
-    lines = []
-    for mp in df.index:
-        n = len(df.loc[mp]["first"])
-        for i in range(n):
-            s1 = gdata.loc[df.loc[mp]["first"][i]]["sp"]
-            c1 = gdata.loc[df.loc[mp]["first"][i]]["chrom"]
-            x1 = gdata.loc[df.loc[mp]["first"][i]]["start"]
-            x2 = gdata.loc[df.loc[mp]["last"][i]]["stop"]
-            if x2 - x1 < minlen:
-                continue
-            for j in range(i+1, n):
-                s2 = gdata.loc[df.loc[mp]["first"][j]]["sp"]
-                c2 = gdata.loc[df.loc[mp]["first"][j]]["chrom"]
-                y1 = gdata.loc[df.loc[mp]["first"][j]]["start"]
-                y2 = gdata.loc[df.loc[mp]["last"][j]]["stop"]
-                d = {"source": {"id": c1, "start": x1, "end": x2},
-                    "target": {"id": c2, "start": y1, "end": y2}}
-                d["value"] = ch_colors["_".join(sorted([s1, s2]))]
-                json_list.append(d)
-    return json_list
+    sx = df["sp_x"].values.astype(object)
+    sy = df["sp_y"].values.astype(object)
+    pair = np.where(sx < sy, sx + "_" + sy, sy + "_" + sx)
+    df["value"] = pd.Series(pair).map(ch_colors).values
+    return df[RIBBON_COLUMNS]
+
+
+def ribbons_to_json(seg, gdata, minlen=1e6):
+    df = ribbons_table(seg, gdata, minlen=minlen)
+    cols = [df[c].tolist() for c in RIBBON_COLUMNS]
+    return [{"source": {"id": c1, "start": x1, "end": x2},
+             "target": {"id": c2, "start": y1, "end": y2}, "value": v}
+        for c1, x1, x2, c2, y1, y2, v in zip(*cols)]
+
+
+def bin_ribbons(df, max_chords, binsize=100000):
+    """
+    Merge chords between the same pair of chromosomes whose ends fall in
+    the same bins, doubling the bin size until at most `max_chords` chords
+    remain (or there is one chord per pair of chromosomes). A merged chord
+    spans all the chords it replaces.
+    """
+    if len(df.index) <= max_chords:
+        return df
+    maxlen = max(df["stop_x"].max(), df["stop_y"].max())
+    while True:
+        keys = [df["chrom_x"], df["chrom_y"], df["value"],
+            df["start_x"] // binsize, df["start_y"] // binsize]
+        binned = df.groupby(keys, observed=True, sort=False).agg(
+            start_x=("start_x", "min"), stop_x=("stop_x", "max"),
+            start_y=("start_y", "min"), stop_y=("stop_y", "max"))
+        if len(binned.index) <= max_chords or binsize > maxlen:
+            break
+        binsize *= 2
+    binned = binned.reset_index(level=[0, 1, 2])
+    if len(binned.index) > max_chords:
+        logging.warning("Could not merge chords below {} (one chord per "
+            "pair of chromosomes)".format(max_chords))
+    logging.info("Merged {} chords into {} (bins of {} bp)".format(
+        len(df.index), len(binned.index), binsize))
+    return binned[RIBBON_COLUMNS].reset_index(drop=True)
+
+
+def ribbons_to_columns(ribbons):
+    """
+    Compact columnar representation of chords (a data frame as returned by
+    `ribbons_table` or a list of circos.js chords): chromosome ids are
+    stored once and referenced by index. Expanded again in the page by
+    `get_circosjs`.
+    """
+    if not isinstance(ribbons, pd.DataFrame):
+        ribbons = pd.DataFrame([(r["source"]["id"], r["source"]["start"],
+            r["source"]["end"], r["target"]["id"], r["target"]["start"],
+            r["target"]["end"], r["value"]) for r in ribbons],
+            columns=RIBBON_COLUMNS)
+    codes, chroms = pd.factorize(pd.concat([
+        ribbons["chrom_x"].astype(object), ribbons["chrom_y"].astype(object)]))
+    n = len(ribbons.index)
+    col = lambda c: [int(x) for x in ribbons[c]]
+    return {"chroms": [str(c) for c in chroms],
+        "sx": codes[:n].tolist(), "s0": col("start_x"), "s1": col("stop_x"),
+        "tx": codes[n:].tolist(), "t0": col("start_y"), "t1": col("stop_y"),
+        "v": col("value")}
+
 
 def reduce_karyotype(kt, ri):
-    chord_elements = set([x["source"]["id"] for x in ri])
-    chord_elements = chord_elements | set([x["target"]["id"] for x in ri])
+    if isinstance(ri, pd.DataFrame):
+        chord_elements = set(ri["chrom_x"]) | set(ri["chrom_y"])
+    else:
+        chord_elements = set([x["source"]["id"] for x in ri])
+        chord_elements |= set([x["target"]["id"] for x in ri])
     kt = [x for x in kt if x["id"] in chord_elements]
     return kt
 
 
 def karyotype_to_json(gdata, minlen=5000000):
     json_list = []
-    df = gdata.groupby(["chrom"])[["stop", "sp"]].max()
+    df = gdata.groupby(["chrom"], observed=True)[["stop", "sp"]].max()
     df = df[df["stop"] > minlen]
     df = df.sort_values(["sp", "stop"], ascending=False)
     colors = get_colors(list(df["sp"].unique()))
     chrcolors = {}
     for chr in df.index:
         chrcolors[chr] = colors[df.loc[chr]["sp"]]
-        json_list.append({"id": chr, "len": df.loc[chr]["stop"],
+        json_list.append({"id": chr, "len": int(df.loc[chr]["stop"]),
             "label": df.loc[chr]["sp"], "color": colors[df.loc[chr]["sp"]]})
     return json_list
 
@@ -144,7 +223,12 @@ def get_chord_colors(species):
     return cols
 
 
-def get_circosjs_doc(karyotype, ribbons, fname, pars):
+def get_circosjs_doc(karyotype, ribbons, fname, pars, circosjs=None):
+    """
+    Write the circos.js HTML document. With `circosjs` (path to a local copy
+    of circos.js) the library is inlined, so that the document also works
+    offline. Returns the size of the document in bytes.
+    """
     info = "Based on {0} and {1}".format(pars[-2], pars[-1])
     if pars[3]:
         info += ", showing all elements > {0} and all blocks > {1}".format(
@@ -154,8 +238,14 @@ def get_circosjs_doc(karyotype, ribbons, fname, pars):
         info += ", showing all elements with blocks > {0} and of total length > {1} all chords > {1}".format(pars[1], pars[0])
         info += " (all = False). "
     info += "Only multiplicons of order > {} are shown.".format(pars[2]-1)
+    library = None
+    if circosjs:
+        with open(circosjs) as f:
+            library = f.read()
+    html = get_html(get_circosjs(karyotype, ribbons), info, library)
     with open(fname, "w") as f:
-        f.write(get_html(get_circosjs(karyotype, ribbons), info))
+        f.write(html)
+    return os.path.getsize(fname)
 
 
 def get_circosjs(karyotype, ribbons):
@@ -211,19 +301,32 @@ def get_circosjs(karyotype, ribbons):
     #colorconf = "{'color:' 'Spectral', 'opacity': 0.75}"
     #chord_conf = {'color': colorfun, 'opacity': 0.75}
     #chord_conf = {'color': 'Spectral', 'opacity': 0.75}
-    js += "\nvar layout_data = " + str(karyotype)
+    js += "\nvar layout_data = " + json.dumps(karyotype, separators=(",", ":"))
+    js += "\nvar r = " + json.dumps(ribbons_to_columns(ribbons),
+        separators=(",", ":"))
+    js += """
+    var chords = r.v.map(function (v, i) {
+        return {source: {id: r.chroms[r.sx[i]], start: r.s0[i], end: r.s1[i]},
+                target: {id: r.chroms[r.tx[i]], start: r.t0[i], end: r.t1[i]},
+                value: v}
+    });"""
     js += "\nmyCircos.layout(layout_data, configuration);"
-    js += "\nmyCircos.chords('synteny', {}, {});".format(
-        str(ribbons), str(colorconf))
+    js += "\nmyCircos.chords('synteny', chords, {});".format(str(colorconf))
     js += "\nmyCircos.render();"
     return js
 
 
-def get_html(js_str, info):
-    html = "<!DOCTYPE html><html><head><script src='https://cdn.rawgit.com/"
-    html += "nicgirault/circosJS/v2/dist/circos.js'></script>"
-    html += """<link rel="stylesheet" href="https://fonts.googleapis.com/icon?family=Material+Icons"> <link rel="stylesheet" href="https://code.getmdl.io/1.3.0/material.indigo-pink.min.css"> <script defer src="https://code.getmdl.io/1.3.0/material.min.js"></script>
+def get_html(js_str, info, library=None):
+    if library is None:
+        html = "<!DOCTYPE html><html><head><script src='https://cdn.rawgit.com/"
+        html += "nicgirault/circosJS/v2/dist/circos.js'></script>"
+        html += """<link rel="stylesheet" href="https://fonts.googleapis.com/icon?family=Material+Icons"> <link rel="stylesheet" href="https://code.getmdl.io/1.3.0/material.indigo-pink.min.css"> <script defer src="https://code.getmdl.io/1.3.0/material.min.js"></script>
     </head><body>"""
+    else:
+        html = "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        # `</script>` in the library would end the script element early
+        html += "<script>{}</script></head><body>".format(
+            library.replace("</", "<\\/"))
     html += "<div><p>{}</p></div>".format(info)
     html += "<div width='100%'><svg width='1500' height='1500' "
     html += "id='chart'></svg></div>"
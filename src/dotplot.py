@@ -1,9 +1,11 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
 import matplotlib.cm as cm
-from matplotlib.colors import Normalize
+from matplotlib.colors import Normalize, LogNorm, to_rgba
+from matplotlib.collections import LineCollection
+from src.ks import anchor_ks, anchor_ks_chunks, multiplicon_ks
+from src.anchorpoints import anchorpoint_chunks
 
 
 def karyotype_axes(ax, kt, g1, g2, minlen=1000000, labelsize=9):
@@ -18,74 +20,245 @@ def karyotype_axes(ax, kt, g1, g2, minlen=1000000, labelsize=9):
     ax.set_yticks(yticks)
     ax.set_yticklabels(yticks.index, rotation=45, ha="right")
     ax.grid(linestyle=":")
-    ax.set_xlim(0, xticks[-1])
-    ax.set_ylim(0, yticks[-1])
+    ax.set_xlim(0, xticks.iloc[-1])
+    ax.set_ylim(0, yticks.iloc[-1])
     return xticks, yticks
 
 
+def chromosome_offsets(ticks):
+    """
+    Cumulative offset (start on the axis) of every chromosome, for the ticks
+    (chromosome ends) returned by `karyotype_axes`.
+    """
+    return ticks.shift(1).fillna(0)
+
+
 def get_segments(df, g1, g2, xticks, yticks):
-    index = {g1: 0, g2:1}
-    ticks = [xticks, yticks]
+    """
+    Get the coordinates on the dot plot axes for all pairs of segments within
+    the multiplicons in `df`, for genome `g1` on the x-axis and `g2` on the
+    y-axis. Returns a data frame with the multiplicon and `x0, x1, y0, y1`
+    for every segment pair.
+    """
     # g1 corrsponds to x-axis genome, g2 to the y-axis genome
+    offsets = {g1: chromosome_offsets(xticks), g2: chromosome_offsets(yticks)}
     df = df[df["genome"].isin([g1, g2])]
-    df = df[df["list"].isin(list(xticks.index) + list(yticks.index))]
-    df = df.groupby("multiplicon").agg(list)
-    df = df[df["genome"].apply(set) == set([g1, g2])]
-    df = df[df["genome"].apply(lambda x: len(x) > 1)]
-    # now we have filtered the data frame down to all we need
-    # now it;'s probably easiest to just loop over the segments.
-    segs = []
-    #return df
-    for r in df.index:
-        mcon = df.loc[r]
-        nseg = len(mcon["genome"])
-        for i in range(nseg):
-            gi = mcon["genome"][i]
-            si = mcon["list"][i]
-            indi = index[gi]
-            for j in range(i+1,nseg):
-                gj = mcon["genome"][j]
-                sj = mcon["list"][j]
-                x = [[0,0],[0,0]]
-                if g1 == g2:
-                    indj = 0
-                else:
-                    indj = index[gj]
-                x[indi][0] = ticks[index[gi]][si] + mcon["start"][i]
-                x[indi][1] = ticks[index[gi]][si] + mcon["stop"][i]
-                x[indj][0] = ticks[index[gj]][sj] + mcon["start"][j]
-                x[indj][1] = ticks[index[gj]][sj] + mcon["stop"][j]
-                segs.append((x, r))
-    return segs
-
-
-def plot_segments(ax, segs, linewidth=2, color="k"):
-    for x, mcon in segs:
-        ax.plot(x[0], x[1], color=color, linewidth=linewidth)
-        ax.plot(x[1], x[0], color=color, linewidth=linewidth)
+    parts = []
+    for g in set([g1, g2]):
+        x = df[df["genome"] == g]
+        x = x[x["list"].isin(offsets[g].index)]
+        offset = offsets[g].loc[x["list"]].values
+        parts.append(pd.DataFrame({"multiplicon": x["multiplicon"].values,
+            "genome": x["genome"].values, "start": x["start"].values + offset,
+            "stop": x["stop"].values + offset}))
+    df = pd.concat(parts).sort_values("multiplicon", kind="mergesort")
+    df["k"] = np.arange(len(df.index))
+    pairs = df.merge(df, on="multiplicon")
+    pairs = pairs[pairs["k_x"] < pairs["k_y"]]
+    if g1 != g2:
+        # only pairs of segments from different genomes
+        pairs = pairs[pairs["genome_x"] != pairs["genome_y"]]
+    # make sure the x-axis segment comes from g1
+    swap = (pairs["genome_x"] != g1).values
+    p = {c: pairs[c].values for c in ["start_x", "stop_x", "start_y",
+        "stop_y"]}
+    return pd.DataFrame({"multiplicon": pairs["multiplicon"].values,
+        "x0": np.where(swap, p["start_y"], p["start_x"]),
+        "x1": np.where(swap, p["stop_y"], p["stop_x"]),
+        "y0": np.where(swap, p["start_x"], p["start_y"]),
+        "y1": np.where(swap, p["stop_x"], p["stop_y"])})
+
+
+def segment_lines(segs, mirror=True):
+    """
+    Get the line segments for `segs` (see `get_segments`) as an array of
+    shape `(n, 2, 2)`. With `mirror`, every segment pair is drawn twice
+    (mirrored around the diagonal, for within-genome dot plots).
+    """
+    x0, x1, y0, y1 = [segs[c].values.astype(float) for c in
+        ["x0", "x1", "y0", "y1"]]
+    lines = np.stack([np.stack([x0, y0], axis=1), np.stack([x1, y1],
+        axis=1)], axis=1)
+    if not mirror:
+        return lines
+    return np.concatenate([lines, lines[:, :, ::-1]])
+
+
+def plot_segments(ax, segs, linewidth=2, color="k", rasterized=False,
+        mirror=True):
+    lc = LineCollection(segment_lines(segs, mirror), colors=color,
+        linewidths=linewidth, rasterized=rasterized)
+    ax.add_collection(lc)
+    return lc
 
 
 def dotplot(ax, kt, df, g1, g2=None, minlen=500000, color="k", linewidth=2,
-        labelsize=8):
+        labelsize=8, rasterized=False):
+    """
+    Dot plot of the segments in `df` (as in the `py-adhore.csv` summary) for
+    genomes `g1` (x-axis) and `g2` (y-axis). All segments are drawn as a
+    single line collection, use `rasterized=True` for very large numbers of
+    segments.
+    """
     if not g2: g2 = g1
     xticks, yticks = karyotype_axes(ax, kt, g1, g2, labelsize=labelsize,
         minlen=minlen);
     segs = get_segments(df, g1, g2, xticks, yticks);
-    plot_segments(ax, segs,color=color, linewidth=linewidth)
+    plot_segments(ax, segs, color=color, linewidth=linewidth,
+        rasterized=rasterized, mirror=g1 == g2)
     return ax
 
 
+def karyotype(gdata):
+    """
+    Gene-based karyotype (as in `karyotype.csv`) for the genes data.
+    """
+    return gdata.groupby(["chrom"], observed=True)[["stop", "sp"]].max()
+
+
+def genome_positions(gdata, genome, ticks):
+    """
+    Positions on a dot plot axis (with chromosome ends `ticks`, see
+    `karyotype_axes`) for the genes of `genome`.
+    """
+    offsets = chromosome_offsets(ticks)
+    gd = gdata[gdata["sp"] == genome]
+    gd = gd[gd["chrom"].isin(offsets.index)]
+    return pd.Series(offsets.loc[gd["chrom"]].values + gd["start"].values,
+        index=gd.index)
+
+
+def pair_positions(gene_x, gene_y, xpos, ypos):
+    """
+    Dot plot coordinates for gene pairs, given the positions of the genes on
+    the x-axis (`xpos`) and y-axis (`ypos`). Both orientations of every pair
+    are considered, so that for a within-genome dot plot every pair yields
+    two (mirrored) points. Returns x, y and the index of the pair for every
+    point.
+    """
+    xs, ys, idx = [], [], []
+    for a, b in [(gene_x, gene_y), (gene_y, gene_x)]:
+        i, j = xpos.index.get_indexer(a), ypos.index.get_indexer(b)
+        ok = (i >= 0) & (j >= 0)
+        xs.append(xpos.values[i[ok]])
+        ys.append(ypos.values[j[ok]])
+        idx.append(np.nonzero(ok)[0])
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(idx)
+
+
+def density_matrix(x, y, xmax, ymax, bins=500):
+    """
+    Bin points in a `bins` x `bins` grid over `[0, xmax] x [0, ymax]`.
+    Returns the counts indexed as `[ybin, xbin]`, and the (flat) bin of
+    every point.
+    """
+    xb = np.clip((x / xmax * bins).astype(np.int64), 0, bins - 1)
+    yb = np.clip((y / ymax * bins).astype(np.int64), 0, bins - 1)
+    b = yb * bins + xb
+    counts = np.bincount(b, minlength=bins*bins).reshape(bins, bins)
+    return counts, b
+
+
+def value_histogram(b, values, vmax, vbins=100):
+    """
+    Partial histograms of `values` per bin (see `density_matrix`), with
+    `vbins` value bins over `[0, vmax]` and one bin for larger values. Returns
+    the (sparse) counts indexed by `bin * (vbins + 1) + value bin`, which can
+    be added over chunks.
+    """
+    ok = ~np.isnan(values)
+    vb = np.clip((values[ok] / vmax * vbins).astype(np.int64), 0, vbins)
+    code, n = np.unique(b[ok] * (vbins + 1) + vb, return_counts=True)
+    return pd.Series(n, index=code)
+
+
+def histogram_medians(hist, bins, vmax, vbins=100):
+    """
+    Median value per bin (NaN for bins without values) from the partial
+    histograms of `value_histogram`, at the resolution of the value bins.
+    Values larger than `vmax` are counted as `vmax`.
+    """
+    hist = hist.sort_index()
+    code, n = hist.index.values, hist.values
+    cell, vb = code // (vbins + 1), code % (vbins + 1)
+    g = pd.Series(n).groupby(cell)
+    cum, total = g.cumsum().values, g.transform("sum").values
+    # value bins of the two middle values (the same if the count is odd)
+    mid = []
+    for k in [(total + 1) // 2, total // 2 + 1]:
+        reached = cum >= k
+        first = reached & ~pd.Series(reached).groupby(cell).shift(
+            fill_value=False).values
+        mid.append(vb[first])
+    at = np.unique(cell, return_index=True)[0]
+    medians = np.full(bins*bins, np.nan)
+    medians[at] = np.minimum((mid[0] + mid[1] + 1) / 2 * vmax / vbins, vmax)
+    return medians.reshape(bins, bins)
+
+
+def dotplot_density(ax, gdata, anchors, g1, g2=None, bins=500, ks=None,
+        minlen=500000, labelsize=8, cmap=cm.viridis, max_ks=5,
+        chunksize=1000000):
+    """
+    Dot plot of anchor (or other gene) pairs as a 2D histogram image, for
+    genomes `g1` (x-axis) and `g2` (y-axis). `anchors` is an anchorpoints
+    file (text or memory-mapped, see `src.anchorpoints`) read in chunks, or
+    a data frame with `gene_x` and `gene_y` columns. If `ks` is given (a wgd
+    Ks table), bins are colored by the median Ks of their anchor pairs (at a
+    resolution of `max_ks / 100`), otherwise by the number of pairs. Counts
+    and Ks histograms are accumulated per chunk. Returns the image.
+    """
+    if not g2: g2 = g1
+    kt = karyotype(gdata)
+    xticks, yticks = karyotype_axes(ax, kt, g1, g2, labelsize=labelsize,
+        minlen=minlen)
+    xmax, ymax = xticks.iloc[-1], yticks.iloc[-1]
+    xpos = genome_positions(gdata, g1, xticks)
+    ypos = genome_positions(gdata, g2, yticks)
+    if ks is not None:
+        chunks = anchor_ks_chunks(anchors, ks, chunksize=chunksize)
+    elif isinstance(anchors, pd.DataFrame):
+        chunks = [anchors]
+    else:
+        chunks = anchorpoint_chunks(anchors, ["gene_x", "gene_y"], chunksize)
+    counts = np.zeros((bins, bins), dtype=np.int64)
+    hist = pd.Series([], dtype=np.int64)
+    for df in chunks:
+        x, y, i = pair_positions(np.asarray(df["gene_x"]),
+            np.asarray(df["gene_y"]), xpos, ypos)
+        c, b = density_matrix(x, y, xmax, ymax, bins)
+        counts += c
+        if ks is not None:
+            hist = hist.add(value_histogram(b, df["Ks"].values[i], max_ks),
+                fill_value=0)
+    if ks is not None:
+        img = np.ma.masked_invalid(histogram_medians(hist.astype(np.int64),
+            bins, max_ks))
+        norm = Normalize(vmin=0, vmax=max_ks)
+    else:
+        img = np.ma.masked_equal(counts, 0)
+        norm = LogNorm(vmin=1, vmax=max(counts.max(), 1))
+    im = ax.imshow(img, origin="lower", extent=[0, xmax, 0, ymax],
+        aspect="auto", interpolation="nearest", cmap=cmap, norm=norm)
+    return im
+
+
 def get_anchor_ks(anchors, ks_distribution):
-    an["pid"] = an[['gene_x', 'gene_y']].apply(
-        lambda x: '__'.join(sorted(x)), axis=1)
-    return an.join(ks, on="pid")
+    """
+    Anchor pairs annotated with Ks, for an anchorpoints file and a wgd Ks
+    table (see `src.ks`).
+    """
+    return anchor_ks(anchors, ks_distribution)
 
 
 def get_median_ks(df, anchors, ks_distribution):
-    anks = get_anchor_ks(anchors, ks_distribution)
-    df = df.join(get_anchor_ks(an, ks).groupby(
-        "multiplicon")["Ks"].median(), on="multiplicon")
-    return df
+    """
+    Add the median Ks of every multiplicon to a data frame with a
+    `multiplicon` column (e.g. the `py-adhore.csv` summary), for use with
+    `dotplot_ks`.
+    """
+    mks = multiplicon_ks(get_anchor_ks(anchors, ks_distribution))
+    return df.join(mks["Ks"], on="multiplicon")
 
 
 def colorhack(cmap):
@@ -96,14 +269,16 @@ def colorhack(cmap):
 
 
 def dotplot_ks(ax, kt, df, g1, g2=None, minlen=500000, color="k", linewidth=2,
-        labelsize=8, cmap=cm.viridis, outlier_color="firebrick", max_ks=5):
+        labelsize=8, cmap=cm.viridis, outlier_color="firebrick", max_ks=5,
+        rasterized=False):
     tmp = colorhack(cmap)
     if not g2: g2 = g1
     xticks, yticks = karyotype_axes(
         ax, kt, g1, g2, labelsize=labelsize, minlen=minlen);
     segs = get_segments(df, g1, g2, xticks, yticks);
     plot_segments_ks(ax, segs, df, cmap=cmap, linewidth=linewidth,
-        max_ks=max_ks, outlier_color=outlier_color)
+        max_ks=max_ks, outlier_color=outlier_color, rasterized=rasterized,
+        mirror=g1 == g2)
     cbar = plt.colorbar(tmp, fraction=0.02, pad=0.01)
     cbar.ax.set_yticklabels(
         ['{:.2f}'.format(x) for x in np.linspace(0.0, max_ks, 11)])
@@ -111,14 +286,24 @@ def dotplot_ks(ax, kt, df, g1, g2=None, minlen=500000, color="k", linewidth=2,
 
 
 def plot_segments_ks(ax, segs, df, linewidth=2, color="k", max_ks=5,
-        cmap=cm.viridis, outlier_color="firebrick"):
+        cmap=cm.viridis, outlier_color="firebrick", rasterized=False,
+        mirror=True):
     norm = Normalize(vmin=0, vmax=max_ks)
-    for x, mcon in segs:
-        ks = df[df["multiplicon"] == mcon].iloc[0]["Ks"]
-        if ks > max_ks:
-            color = outlier_color
-        else:
-            color = cmap(norm(ks))
-        ax.plot(x[0], x[1], color=color, linewidth=linewidth)
-        ax.plot(x[1], x[0], color=color, linewidth=linewidth)
+    ks = ks_lookup(df)
+    ks = segs["multiplicon"].map(ks).values.astype(float)
+    colors = cmap(norm(ks))
+    colors[ks > max_ks] = to_rgba(outlier_color)
+    if mirror:
+        colors = np.concatenate([colors, colors])
+    lc = LineCollection(segment_lines(segs, mirror), colors=colors,
+        linewidths=linewidth, rasterized=rasterized)
+    ax.add_collection(lc)
     return ax
+
+
+def ks_lookup(df):
+    """
+    Ks value for every multiplicon, for a data frame with a `Ks` column
+    (one value per multiplicon) and possibly multiple rows per multiplicon.
+    """
+    return df.drop_duplicates("multiplicon").set_index("multiplicon")["Ks"]
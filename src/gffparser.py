@@ -1,7 +1,8 @@
 """
 The fully feature `gffutils` package is too slow on typical full GFF files for
 the purposes here (database should be created on the fly and destroyed
-afterwards).
+afterwards), so we use a simple single-pass GFF3 reader that only keeps the
+features and attribute of interest.
 
 A command line could look like
 
@@ -9,50 +10,191 @@ A command line could look like
 
 for file1 with features gene & mRNA and file2 with features gene (idem for attr)
 """
-import gffutils
-import tempfile
+import hashlib
 import logging
 import os
 import pandas as pd
-from collections import defaultdict
-
-
-def gffs_to_genelists(fnames, features, attributes, genes, outdir):
-    confs = []
-    genes_data = {}
-    for i, fname in enumerate(fnames):
-        logging.info("Loading {} into database ... ".format(fname))
-        feat = features[i]
-        attr = attributes[i]
-        db = load_gff(fname, feat)
-        genome = os.path.basename(fname) + "_lists"
-        gconf, gdata = write_gene_lists(db, genes, genome, outdir,
+import numpy as np
+from urllib.parse import unquote
+from multiprocessing import Pool
+from src.cache import cache_path, evict
+from src.store import read_table, write_table
+
+
+def gffs_to_genelists(fnames, features, attributes, genes, outdir,
+        processes=1, cache_dir=None, keys=None):
+    """
+    Write the gene lists for every GFF file. With `processes > 1` the GFF
+    files are processed in a process pool, the gene tables are merged in the
+    order of `fnames` so that the result is the same as for a serial run.
+    If `cache_dir` is given, parsed GFF files are cached in that directory.
+
+    If `keys` is given (a dictionary with a key for every genome from a
+    previous run, see `genelist_key`), the gene lists of genomes for which the
+    key did not change are not rewritten. `keys` is updated in place.
+    """
+    args = [(fname, features[i], attributes[i], outdir, cache_dir, keys)
+        for i, fname in enumerate(fnames)]
+    if processes > 1 and len(fnames) > 1:
+        processes = min(processes, len(fnames))
+        logging.info("Processing {} GFF files using {} processes".format(
+            len(fnames), processes))
+        with Pool(processes, initializer=_init_worker,
+                initargs=(genes,)) as pool:
+            results = pool.map(_gff_to_genelists, args)
+    else:
+        _init_worker(genes)
+        results = [_gff_to_genelists(x) for x in args]
+    if cache_dir:
+        evict(cache_dir)
+    if keys is not None:
+        keys.update({r[0]["genome"]: r[2] for r in results})
+    confs = [r[0] for r in results]
+    return confs, merge_genes_data([r[1] for r in results])
+
+
+_genes = {}
+
+
+def _init_worker(genes):
+    # the gene to family mapping is shared by all tasks of a worker
+    global _genes
+    _genes = genes
+
+
+def _gff_to_genelists(args):
+    fname, feat, attr, outdir, cache_dir, keys = args
+    logging.info("Loading {} ... ".format(fname))
+    if cache_dir:
+        gff = load_gff_cached(fname, feat, attr, cache_dir)
+    else:
+        gff = load_gff(fname, feat, attr)
+    genome = os.path.basename(fname) + "_lists"
+    if keys is None:
+        conf, gdata = write_gene_lists(gff, _genes, genome, outdir,
             attr=attr, features=feat)
-        confs.append(gconf)
-        genes_data.update(gdata)
-    return confs, pd.DataFrame.from_dict(genes_data).transpose()
+        return conf, gdata, None
+    key = genelist_key(gff, _genes, genome, feat, attr)
+    stored = os.path.join(outdir, genome, "genes_data.npz")
+    if keys.get(genome) == key and os.path.isfile(stored):
+        conf, gdata = read_gene_lists(stored, genome, outdir)
+        # genes data stored before gene list ranks were recorded is rewritten
+        if "rank" in gdata.columns and all(os.path.isfile(
+                x.split(" ", 1)[1]) for x in conf["lists"]):
+            logging.info("Gene lists for {} are up to date".format(genome))
+            return conf, gdata, key
+    conf, gdata = write_gene_lists(gff, _genes, genome, outdir, attr=attr,
+        features=feat)
+    write_table(gdata, stored)
+    return conf, gdata, key
+
+
+def genelist_key(gff, genes, genome, features, attr):
+    """
+    Hash of the content the gene lists for a genome depend on: the parsed GFF
+    and the families of its genes.
+    """
+    df = gff.assign(family=gff["id"].map(genes).astype(str))
+    h = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values)
+    h.update("\t".join([genome, ";".join(features), attr]).encode())
+    return h.hexdigest()
+
+
+def read_gene_lists(fname, genome, path):
+    """
+    Read the genes data for a genome stored by a previous run, and get the
+    corresponding gene lists configuration.
+    """
+    gdata = read_table(fname)
+    chroms = sorted(gdata["chrom"].astype(str).unique())
+    genome_path = os.path.join(path, genome)
+    config = {"genome": genome, "lists": ["{} {}".format(chr, os.path.abspath(
+        os.path.join(genome_path, "{}.lst".format(chr)))) for chr in chroms]}
+    return config, gdata
 
 
-def load_gff(fn, features=["gene"]):
+def merge_genes_data(genes_data):
+    """
+    Merge per-genome gene tables, when a gene ID occurs more than once the
+    last occurrence is retained.
     """
-    Load a gff file in a database, ignoring all features not in `features`.
-    Uses tempfiles
+    df = pd.concat(genes_data)
+    return df[~df.index.duplicated(keep="last")]
+
+
+def load_gff(fn, features=["gene"], attr="ID"):
     """
+    Load a GFF3 file in a data frame, ignoring all features not in `features`.
+    Only the `attr` attribute is retained (first value if multiple). The data
+    frame is sorted by feature (in the order of `features`), chromosome and
+    start coordinate.
+    """
+    features = list(features)
+    keep = set(features)
+    key = attr + "="
+    ids, chroms, feats, strands, starts, stops = [], [], [], [], [], []
     with open(fn, "r") as f:
-        lines = [l for l in f.readlines() if
-            (l[0] != "#" and l.split("\t")[2] in features)]
-    gff = tempfile.NamedTemporaryFile(suffix=".gff", mode="w+t")
-    gff.write("\n".join(lines))
-    gff.seek(0)
-    dbfn = tempfile.NamedTemporaryFile(suffix=".db")
-    db = gffutils.create_db(gff.name, dbfn=dbfn.name, force=True,
-        merge_strategy='merge')
-    # db is an open database connection, as soon as the connection is closed
-    # the tempfile should be destroyed.
-    return db
+        for line in f:
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+            l = line.rstrip("\r\n").split("\t", 8)
+            if len(l) < 9 or l[2] not in keep:
+                continue
+            g_id = _get_attribute(l[8], key)
+            if g_id is None:
+                logging.debug("Feature without {} attribute at {}:{}".format(
+                    attr, l[0], l[3]))
+                continue
+            ids.append(g_id)
+            chroms.append(l[0])
+            feats.append(l[2])
+            strands.append(l[6])
+            starts.append(l[3])
+            stops.append(l[4])
+    df = pd.DataFrame({
+        "id": ids,
+        "chrom": pd.Categorical(chroms),
+        "feat": pd.Categorical(feats, categories=features),
+        "strand": pd.Categorical(strands),
+        "start": np.array(starts, dtype=np.int64),
+        "stop": np.array(stops, dtype=np.int64)})
+    df = df.drop_duplicates()
+    df = df.sort_values(["feat", "chrom", "start"], kind="mergesort")
+    return df.reset_index(drop=True)
 
 
-def write_gene_lists(db, genes, genome, path, attr="ID", features=["gene"]):
+def load_gff_cached(fn, features, attr, cache_dir):
+    """
+    Load a GFF file with `load_gff`, using the parsed table stored in
+    `cache_dir` if the file, features and attribute did not change.
+    """
+    features = list(features)
+    cfn = cache_path(cache_dir, fn, features, attr)
+    if os.path.isfile(cfn):
+        logging.info("Using cached table for {}".format(fn))
+        os.utime(cfn)
+        return read_table(cfn)
+    df = load_gff(fn, features, attr)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_table(df, cfn)
+    return df
+
+
+def _get_attribute(attributes, key):
+    """
+    Get the first value of an attribute from a GFF3 attribute column, where
+    `key` is the attribute name followed by `=`.
+    """
+    for kv in attributes.split(";"):
+        kv = kv.strip()
+        if kv.startswith(key):
+            return unquote(kv[len(key):].split(",")[0])
+    return None
+
+
+def write_gene_lists(gff, genes, genome, path, attr="ID", features=["gene"]):
     """
     Write the gene lists for a single gff (single species). This is how the
     results should be organized (and this is also how it's written in the
@@ -63,6 +205,7 @@ def write_gene_lists(db, genes, genome, path, attr="ID", features=["gene"]):
         chromname path/second_chrom.lst
         chromname path/third_chrom.lst
         ```
+    `gff` is a data frame as obtained with `load_gff`.
     """
     genome_path = os.path.join(path, genome)
     config = {"genome": genome, "lists": []}
@@ -71,24 +214,26 @@ def write_gene_lists(db, genes, genome, path, attr="ID", features=["gene"]):
     except FileExistsError:
         logging.warning("Directory `{}` already exists, will possibly "
             "overwrite".format(genome_path))
-    genomic_elements = defaultdict(list)
-    genes_data = {}
-    c1, c2 = 0, 0
-    for f in features:
-        for g in db.features_of_type(f, order_by='start'):
-            g_id = g.attributes[attr][0]
-            if g_id not in genes.keys():
-                logging.debug("Feature {} not found in families".format(g_id))
-                c2 += 1
-                continue
-            c1 += 1
-            genes_data[g_id] = {"family": genes[g_id], "feat": f, "chrom": g.chrom,
-                                "sp": genome, "strand": g.strand, "start": g.start,
-                                "stop": g.stop}
-            genomic_elements[g.chrom].append(g_id + g.strand)
-    c = c1 + c2
-    logging.info("{:.2f}% of genes not found in families".format(100*c2/c))
-    for chr, lst in genomic_elements.items():
+    family = gff["id"].map(genes)
+    found = family.notnull()
+    c1, c = found.sum(), len(found)
+    logging.debug("{} features not found in families".format(c - c1))
+    logging.info("{:.2f}% of genes not found in families".format(
+        100*(c - c1)/c))
+    gff = gff[found]
+    genes_data = pd.DataFrame({
+        "family": family[found].values,
+        "feat": gff["feat"].astype(str).values,
+        "chrom": gff["chrom"].astype(str).values,
+        "sp": genome,
+        "strand": gff["strand"].astype(str).values,
+        "start": gff["start"].values,
+        "stop": gff["stop"].values}, index=gff["id"].values)
+    # within a chromosome, the order is by feature type (in the order of
+    # `features`) and start coordinate, `rank` is the position in the list
+    genes_data["rank"] = genes_data.groupby("chrom", sort=False).cumcount()
+    elements = gff["id"] + gff["strand"].astype(str)
+    for chr, lst in elements.groupby(gff["chrom"].astype(str), sort=True):
         p = os.path.join(genome_path, "{}.lst".format(chr))
         with open(p, "w") as f:
             f.write("\n".join(lst))
@@ -97,7 +242,7 @@ def write_gene_lists(db, genes, genome, path, attr="ID", features=["gene"]):
 
 
 def write_karyotype(gdata, fname):
-    df = gdata.groupby(["chrom"])[["stop", "sp"]].max()
+    df = gdata.groupby(["chrom"], observed=True)[["stop", "sp"]].max()
     df["start"] = 0
     df.to_csv(fname, sep=",")
     return os.path.abspath(fname)
@@ -0,0 +1,348 @@
+"""
+Interval index over the genes, segments and anchor points of I-ADHoRe
+results, for region queries (`chrom:start-stop`) and gene queries (syntenic
+partners of a gene). Every kind of interval is kept in a nested containment
+list per chromosome: intervals contained in another interval are moved to the
+sublist of that interval, so that in every (sub)list both the start and the
+stop coordinates are sorted. The intervals overlapping a region are then a
+contiguous range of a list, found by binary search, and only the sublists of
+overlapping intervals need to be searched. All lists are stored in flat
+arrays, and queries for many regions are answered together. The index can be
+saved to (and loaded from) a `.npz` file.
+"""
+import logging
+import os
+import re
+import numpy as np
+import pandas as pd
+from src.anchorpoints import read_anchorpoints
+from src.circos import segment_coordinates
+
+TRACKS = ["genes", "segments", "anchors"]
+# nested containment list arrays of a track (see `nested_lists`)
+LIST_ARRAYS = ["top_lo", "top_hi", "nc_rows", "nc_start", "nc_stop", "nc_lo",
+    "nc_hi"]
+
+
+class IntervalIndex():
+    """
+    Interval index with a track (dictionary of arrays, see `make_track`) for
+    genes, segments and anchor points (two intervals per anchor pair, one
+    for every gene).
+    """
+    def __init__(self, tracks):
+        self.tracks = tracks
+        # gene track positions of the genes, sorted by gene name
+        genes = tracks["genes"]["gene"]
+        self.gene_order = np.argsort(genes, kind="stable")
+        self.gene_names = genes[self.gene_order]
+
+    def save(self, fname):
+        arrays = {"{}.{}".format(t, k): v for t in TRACKS
+            for k, v in self.tracks[t].items()}
+        tmp = fname + ".{}.tmp.npz".format(os.getpid())
+        np.savez(tmp, **arrays)
+        os.replace(tmp, fname)
+        return os.path.abspath(fname)
+
+    @classmethod
+    def load(cls, fname):
+        tracks = {t: {} for t in TRACKS}
+        with np.load(fname, allow_pickle=False) as f:
+            for k in f.files:
+                t, c = k.split(".", 1)
+                tracks[t][c] = f[k]
+        if not all(c in tracks[t] for t in TRACKS for c in LIST_ARRAYS):
+            raise ValueError("Index `{}` was written by an older "
+                "version".format(fname))
+        return cls(tracks)
+
+    def regions(self, chrom, start, stop, names=None):
+        """
+        All genes, segments and anchor points overlapping the regions (1-based
+        closed intervals) `chrom[i]:start[i]-stop[i]`. Returns a dictionary of
+        data frames, with the region (or its name in `names`) in the `query`
+        column.
+        """
+        chrom = np.asarray(chrom).astype(str)
+        start = np.asarray(start, dtype=np.int64)
+        stop = np.asarray(stop, dtype=np.int64)
+        if names is None:
+            names = np.array(["{}:{}-{}".format(*x) for x in
+                zip(chrom, start, stop)], dtype=object)
+        names = np.asarray(names, dtype=object)
+        out = {}
+        for t in TRACKS:
+            qi, rows = overlaps(self.tracks[t], chrom, start, stop)
+            out[t] = track_frame(self.tracks[t], rows, names[qi])
+        return out
+
+    def region(self, chrom, start, stop):
+        return self.regions([chrom], [start], [stop])
+
+    def genes(self, genes):
+        """
+        The syntenic partners of `genes`: their anchor points (with the
+        `partner` gene), the partner genes and the segments containing the
+        genes. Genes not in the index are reported with a warning.
+        """
+        genes = np.asarray(genes).astype(str)
+        i = np.searchsorted(self.gene_names, genes)
+        i[i == len(self.gene_names)] = 0
+        found = self.gene_names[i] == genes if len(self.gene_names) else \
+            np.zeros(len(genes), dtype=bool)
+        if not found.all():
+            logging.warning("Genes not found: {}".format(
+                ", ".join(genes[~found])))
+        g = self.tracks["genes"]
+        pos = self.gene_order[i[found]]
+        genes = genes[found]
+        hits = self.regions(g["chrom"][pos], g["start"][pos], g["stop"][pos],
+            names=genes)
+        anchors = hits["anchors"]
+        anchors = anchors[anchors["gene"] == anchors["query"]]
+        segments = hits["segments"]
+        partners = anchors[["query", "partner"]].drop_duplicates()
+        rows = self.gene_order[np.searchsorted(self.gene_names,
+            partners["partner"].values.astype(str))]
+        return {"genes": track_frame(g, rows, partners["query"].values),
+            "segments": segments.reset_index(drop=True),
+            "anchors": anchors.reset_index(drop=True)}
+
+
+def make_track(chrom, start, stop, **columns):
+    """
+    Sort intervals by chromosome, start and (decreasing) stop, and store them
+    as arrays with the chromosome names (`chroms`), the bounds of every
+    chromosome in the sorted arrays (`bounds`) and the nested containment
+    lists (see `nested_lists`). Other `columns` are stored along.
+    """
+    chrom = np.asarray(chrom).astype(str)
+    start = np.asarray(start, dtype=np.int64)
+    stop = np.asarray(stop, dtype=np.int64)
+    order = np.lexsort((-stop, start, chrom))
+    chrom, start, stop = chrom[order], start[order], stop[order]
+    chroms, first = np.unique(chrom, return_index=True)
+    bounds = np.r_[first, len(chrom)].astype(np.int64)
+    track = {"chroms": chroms, "bounds": bounds, "chrom": chrom,
+        "start": start, "stop": stop}
+    track.update(nested_lists(start, stop, bounds))
+    for k, v in columns.items():
+        v = np.asarray(v)
+        track[k] = v[order].astype(str) if v.dtype == object else v[order]
+    return track
+
+
+def nested_lists(start, stop, bounds):
+    """
+    Nested containment lists for intervals sorted by chromosome (with
+    `bounds`), start and decreasing stop. Every interval is in the list of
+    the last preceding interval of its list that contains it (or in the top
+    level list of its chromosome), so that within a list starts and stops
+    are increasing. The lists are stored contiguously in `nc_rows` (the
+    intervals) with their `nc_start` and `nc_stop`, `nc_lo` and `nc_hi` are
+    the range of the sublist of every interval and `top_lo` and `top_hi`
+    the range of the top level list of every chromosome. The lists are built
+    one nesting level at a time.
+    """
+    n = len(start)
+    nchrom = len(bounds) - 1
+    # list of every interval: its parent interval, or n + chromosome index
+    group = n + np.repeat(np.arange(nchrom), np.diff(bounds))
+    active = np.arange(n)
+    while len(active):
+        g = group[active]
+        s = stop[active]
+        first = np.r_[True, g[1:] != g[:-1]]
+        # running maximum of the stops before every interval in its list
+        runmax = pd.Series(s).groupby(g, sort=False).cummax().values
+        top = first | (s > np.r_[0, runmax[:-1]])
+        # intervals not in this list are in the list of the last interval
+        # of this list before them, which contains them
+        last = np.maximum.accumulate(np.where(top, np.arange(len(s)), 0))
+        contained = ~top
+        group[active[contained]] = active[last[contained]]
+        active = active[contained]
+    order = np.argsort(group, kind="stable")
+    g = group[order]
+    lists = np.arange(n)
+    chroms = n + np.arange(nchrom)
+    return {"nc_rows": order, "nc_start": start[order],
+        "nc_stop": stop[order],
+        "nc_lo": np.searchsorted(g, lists), "nc_hi": np.searchsorted(g,
+        lists, "right"), "top_lo": np.searchsorted(g, chroms),
+        "top_hi": np.searchsorted(g, chroms, "right")}
+
+
+def overlaps(track, chrom, start, stop):
+    """
+    Find all intervals in `track` overlapping the query regions. Returns the
+    query index and the track position of every overlap.
+    """
+    qi, rows, _ = search(track, chrom, start, stop)
+    return qi, rows
+
+
+def search(track, chrom, start, stop):
+    """
+    Search the nested containment lists of `track` for the query regions,
+    starting with the top level list of the chromosome of every region. In
+    every list, the overlapping intervals are the range between the first
+    interval that stops at or after the start of the region and the first
+    interval that starts after its end, found by binary search, after which
+    the sublists of these intervals are searched. Returns the query index
+    and track position of every overlap, and the number of intervals that
+    were considered (which equals the number of overlaps).
+    """
+    chrom = np.asarray(chrom).astype(str)
+    start = np.asarray(start, dtype=np.int64)
+    stop = np.asarray(stop, dtype=np.int64)
+    k = np.searchsorted(track["chroms"], chrom)
+    k[k == len(track["chroms"])] = 0
+    qi = np.nonzero(track["chroms"][k] == chrom)[0] if len(
+        track["chroms"]) else np.array([], dtype=np.int64)
+    lo, hi = track["top_lo"][k[qi]], track["top_hi"][k[qi]]
+    qis, rows = [], []
+    considered = 0
+    while len(qi):
+        a = _bisect(track["nc_stop"], lo, hi, start[qi])
+        b = _bisect(track["nc_start"], a, hi, stop[qi], right=True)
+        n = b - a
+        considered += n.sum()
+        q = np.repeat(qi, n)
+        r = track["nc_rows"][np.repeat(a, n) + np.arange(n.sum()) -
+            np.repeat(np.cumsum(n) - n, n)]
+        qis.append(q)
+        rows.append(r)
+        lo, hi = track["nc_lo"][r], track["nc_hi"][r]
+        sub = hi > lo
+        qi, lo, hi = q[sub], lo[sub], hi[sub]
+    if len(qis) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, 0
+    qi, r = np.concatenate(qis), np.concatenate(rows)
+    order = np.lexsort((r, qi))
+    return qi[order], r[order], int(considered)
+
+
+def _bisect(values, lo, hi, x, right=False):
+    # vectorized binary search of `x` in the sorted ranges values[lo:hi]
+    lo, hi = lo.copy(), hi.copy()
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = np.where(active, (lo + hi) // 2, 0)
+        v = values[mid]
+        go = active & ((v <= x) if right else (v < x))
+        lo = np.where(go, mid + 1, lo)
+        hi = np.where(active & ~go, mid, hi)
+
+
+def track_frame(track, rows, query):
+    skip = ["chroms", "bounds"] + LIST_ARRAYS
+    df = pd.DataFrame({k: v[rows] for k, v in track.items()
+        if k not in skip})
+    df.insert(0, "query", query)
+    return df
+
+
+def build_index(gdata, segments, anchorpoints):
+    """
+    Build the interval index for the genes data, the segments (as in
+    `segments.txt`) and the anchorpoints file (or a data frame as obtained
+    with `read_anchorpoints`).
+    """
+    genes = make_track(gdata["chrom"], gdata["start"], gdata["stop"],
+        gene=gdata.index.values.astype(str), sp=gdata["sp"].astype(str))
+    seg = segment_coordinates(segments, gdata)
+    segs = make_track(seg["chrom"], seg["start"], seg["stop"],
+        segment=seg.index.values, multiplicon=seg["multiplicon"].values,
+        sp=seg["sp"].astype(str))
+    ap = anchorpoints if isinstance(anchorpoints, pd.DataFrame) else \
+        read_anchorpoints(anchorpoints, ["id", "multiplicon", "gene_x",
+        "gene_y"])
+    pos = gdata.index.get_indexer(ap["gene_x"].cat.categories)
+    x, y = ap["gene_x"].cat.codes.values, ap["gene_y"].cat.codes.values
+    ok = (pos[x] >= 0) & (pos[y] >= 0)
+    if not ok.all():
+        logging.warning("{} anchor pairs with genes not in genes data".format(
+            (~ok).sum()))
+    genes_ = np.asarray(ap["gene_x"].cat.categories).astype(str)
+    gx, gy = pos[x[ok]], pos[y[ok]]
+    g = np.concatenate([gx, gy])
+    anchors = make_track(gdata["chrom"].astype(str).values[g],
+        gdata["start"].values[g], gdata["stop"].values[g],
+        anchor=np.concatenate([ap["id"].values[ok]] * 2),
+        multiplicon=np.concatenate([ap["multiplicon"].values[ok]] * 2),
+        gene=np.concatenate([genes_[x[ok]], genes_[y[ok]]]),
+        partner=np.concatenate([genes_[y[ok]], genes_[x[ok]]]))
+    return IntervalIndex({"genes": genes, "segments": segs,
+        "anchors": anchors})
+
+
+def read_bed(fname):
+    """
+    Read regions from a BED file (0-based, half-open) as 1-based closed
+    intervals `(chrom, start, stop, names)`. Regions are named by the fourth
+    column if present (as `chrom:start-stop` otherwise). Header (`track`,
+    `browser`), comment and empty lines are skipped.
+    """
+    chrom, start, stop, names = [], [], [], []
+    with open(fname, "r") as f:
+        for i, line in enumerate(f):
+            if not line.strip() or line.startswith(("#", "track",
+                    "browser")):
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < 3:
+                raise ValueError("Line {} of `{}` has fewer than 3 "
+                    "fields".format(i + 1, fname))
+            try:
+                s, e = int(fields[1]) + 1, int(fields[2])
+            except ValueError:
+                raise ValueError("Line {} of `{}` has a non-integer start "
+                    "or end ({}, {})".format(i + 1, fname, fields[1],
+                    fields[2]))
+            chrom.append(fields[0])
+            start.append(s)
+            stop.append(e)
+            names.append(fields[3] if len(fields) > 3 and fields[3] else
+                "{}:{}-{}".format(fields[0], s, e))
+    chrom = np.array(chrom, dtype=str)
+    start = np.array(start, dtype=np.int64)
+    stop = np.array(stop, dtype=np.int64)
+    names = np.array(names, dtype=object)
+    return chrom, start, stop, names
+
+
+def parse_region(region):
+    """
+    Parse a region `chrom:start-stop` (1-based, closed, commas allowed in the
+    coordinates), or a whole chromosome `chrom`. Raises a `ValueError` for
+    malformed regions.
+    """
+    if ":" not in region:
+        if not region:
+            raise ValueError("empty region")
+        return region, 0, np.iinfo(np.int64).max
+    chrom, coords = region.rsplit(":", 1)
+    m = re.fullmatch(r"(\d[\d,]*)-(\d[\d,]*)", coords)
+    if not chrom or not m:
+        raise ValueError("`{}` is not a region (chrom:start-stop or "
+            "chrom)".format(region))
+    start, stop = [int(x.replace(",", "")) for x in m.groups()]
+    if start > stop:
+        raise ValueError("start > stop in `{}`".format(region))
+    return chrom, start, stop
+
+
+def is_fresh(fname, inputs):
+    """
+    Whether the saved index `fname` exists and is not older than any of the
+    files it was built from.
+    """
+    if not os.path.isfile(fname):
+        return False
+    t = os.path.getmtime(fname)
+    return all(os.path.getmtime(x) <= t for x in inputs if os.path.exists(x))
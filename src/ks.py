@@ -0,0 +1,107 @@
+"""
+Annotation of anchor pairs with Ks values from a wgd-style Ks table, i.e. a
+tab-separated file with gene pair IDs (`gene1__gene2`) in the first column
+and a `Ks` column. Gene pairs are matched in an order-independent way using
+hashes of both genes, and the Ks table is read in chunks, keeping only the
+pairs that are anchor pairs.
+"""
+import numpy as np
+import pandas as pd
+from src.anchorpoints import read_anchorpoints, anchorpoint_chunks
+
+CHUNKSIZE = 1000000
+
+
+def gene_hash(genes):
+    return pd.util.hash_array(np.asarray(genes, dtype=object))
+
+
+def pair_key(hx, hy):
+    """
+    Order-independent key for gene pairs, given the hashes of both genes.
+    """
+    lo, hi = np.minimum(hx, hy), np.maximum(hx, hy)
+    with np.errstate(over="ignore"):
+        return lo * np.uint64(0x9E3779B97F4A7C15) + hi
+
+
+def anchor_keys(anchors):
+    """
+    Pair keys for the anchor pairs in a data frame as obtained with
+    `read_anchorpoints` (genes are hashed once per distinct gene).
+    """
+    keys = []
+    for c in ["gene_x", "gene_y"]:
+        cat = anchors[c].cat
+        keys.append(gene_hash(cat.categories)[cat.codes])
+    return pair_key(*keys)
+
+
+def read_ks(fname, keys=None, chunksize=CHUNKSIZE):
+    """
+    Read a Ks table in chunks, returns a series with Ks values indexed by pair
+    key (see `pair_key`). If `keys` is given, only those pairs are retained.
+    """
+    header = pd.read_csv(fname, sep="\t", index_col=0, nrows=0)
+    usecols = [0, list(header.columns).index("Ks") + 1]
+    parts = []
+    for df in pd.read_csv(fname, sep="\t", index_col=0, usecols=usecols,
+            chunksize=chunksize):
+        pairs = df.index.to_series().str.split("__", n=1, expand=True)
+        k = pair_key(gene_hash(pairs[0]), gene_hash(pairs[1]))
+        ks = pd.Series(df["Ks"].values, index=k)
+        if keys is not None:
+            ks = ks[np.isin(k, keys)]
+        parts.append(ks[ks.notnull()])
+    if len(parts) == 0:
+        return pd.Series([], dtype=float)
+    ks = pd.concat(parts)
+    return ks[~ks.index.duplicated(keep="first")]
+
+
+def anchor_ks(anchorpoints, ks_file, chunksize=CHUNKSIZE):
+    """
+    Get the anchor pairs (text file or memory-mapped version, see
+    `src.anchorpoints`) annotated with their Ks value (NaN when not in the
+    Ks table).
+    """
+    anchors = read_anchorpoints(anchorpoints, chunksize=chunksize)
+    keys = anchor_keys(anchors)
+    ks = read_ks(ks_file, keys=np.unique(keys), chunksize=chunksize)
+    anchors["Ks"] = ks.reindex(keys).values
+    return anchors
+
+
+def anchor_ks_chunks(anchorpoints, ks_file, columns=["gene_x", "gene_y"],
+        chunksize=CHUNKSIZE):
+    """
+    Iterate over the anchor pairs in chunks (data frames with `columns`)
+    annotated with their Ks value, as `anchor_ks` but without holding all
+    anchor pairs in memory (only the Ks values of the anchor pairs).
+    """
+    keys = np.array([], dtype=np.uint64)
+    for df in anchorpoint_chunks(anchorpoints, ["gene_x", "gene_y"],
+            chunksize):
+        keys = np.union1d(keys, pair_key(gene_hash(df["gene_x"]),
+            gene_hash(df["gene_y"])))
+    ks = read_ks(ks_file, keys=keys, chunksize=chunksize).sort_index()
+    kk, kv = ks.index.values.astype(np.uint64), ks.values
+    cols = list(columns) + [c for c in ["gene_x", "gene_y"]
+        if c not in columns]
+    for df in anchorpoint_chunks(anchorpoints, cols, chunksize):
+        k = pair_key(gene_hash(df["gene_x"]), gene_hash(df["gene_y"]))
+        i = np.clip(np.searchsorted(kk, k), 0, max(len(kk) - 1, 0))
+        found = kk[i] == k if len(kk) else np.zeros(len(k), dtype=bool)
+        df = df[list(columns)].copy()
+        df["Ks"] = np.where(found, kv[i] if len(kv) else np.nan, np.nan)
+        yield df
+
+
+def multiplicon_ks(anchors):
+    """
+    Median Ks, number of anchor pairs and number of anchor pairs with a Ks
+    value for every multiplicon.
+    """
+    g = anchors.groupby("multiplicon")
+    return pd.DataFrame({"Ks": g["Ks"].median(), "anchor_pairs": g.size(),
+        "anchor_pairs_ks": g["Ks"].count()})
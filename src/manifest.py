@@ -0,0 +1,62 @@
+"""
+Manifest for incremental re-execution of the `of` pipeline. For every stage,
+the manifest (`manifest.json` in the output directory) records a key, i.e. a
+hash of the content of its inputs and of the relevant options, and the output
+files of the stage. On a rerun, a stage is skipped when its key did not
+change and its outputs still exist.
+"""
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST = "manifest.json"
+
+
+def file_hash(fname, blocksize=2**20):
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_key(*parts):
+    """
+    Hash of a number of JSON serializable objects.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True,
+        default=str).encode()).hexdigest()
+
+
+def load_manifest(outdir):
+    fname = os.path.join(outdir, MANIFEST)
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, outdir):
+    fname = os.path.join(outdir, MANIFEST)
+    tmp = fname + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, fname)
+    return os.path.abspath(fname)
+
+
+def up_to_date(manifest, stage, key, outputs):
+    """
+    Check whether a stage with `key` was already run and its outputs exist.
+    """
+    entry = manifest.get(stage, {})
+    if entry.get("key") != key or not all(os.path.exists(x) for x in outputs):
+        return False
+    logging.info("Stage `{}` is up to date, skipping".format(stage))
+    return True
+
+
+def record(manifest, stage, key, outputs):
+    manifest[stage] = {"key": key,
+        "outputs": [os.path.abspath(x) for x in outputs]}
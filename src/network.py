@@ -2,40 +2,81 @@
 
 # under the transitivity assumption, we do not cluster the network, and we
 # simply need to get a profile for each connected component; so we have to get
-# the connected components from the anchorpoints file
+# the connected components from the anchorpoints file. Genes are encoded as
+# integers and the components are obtained with an array-based union-find.
 
-import networkx as nx
+import logging
+import numpy as np
 import pandas as pd
+from src.anchorpoints import gene_pairs
 
-def get_clusters(anchorpoints_file, genes_data):
-    # anchorpoints should be provided as file, no use to have a df in memory
-    sn = get_network(anchorpoints_file)
-    cc = nx.connected_components(sn)
-    clusters = {}
-    sps = genes_data.sp.unique()
-    for component in cc:
-        d = {sp: [] for sp in sps}
-        for gene in component:
-            d[genes_data.loc[gene].sp].append(gene)
-        exemplar = component.pop()
-        family = genes_data.loc[exemplar].family
-        clusters[family] = d
-    df = pd.DataFrame.from_dict(clusters).transpose()
-    counts = df.applymap(lambda x: len(x))
-    genes = df.applymap(lambda x: ", ".join(x))
+
+def get_clusters(anchorpoints, genes_data):
+    # anchorpoints are best provided as file (only the gene pairs are read),
+    # or as a data frame as obtained with `read_anchorpoints`
+    if isinstance(anchorpoints, pd.DataFrame):
+        x, y, genes = anchor_codes(anchorpoints)
+    else:
+        x, y, genes = gene_pairs(anchorpoints)
+    component = connected_components(x, y, len(genes))
+    df = pd.DataFrame({"component": component,
+        "position": genes_data.index.get_indexer(genes)}, index=genes)
+    missing = df["position"] < 0
+    if missing.any():
+        logging.warning("{} anchor genes not in genes data, ignoring".format(
+            missing.sum()))
+        df = df[~missing]
+    df["sp"] = genes_data["sp"].values[df["position"].values]
+    df["family"] = genes_data["family"].values[df["position"].values]
+    # genes within a cluster are in the order of the genes data, clusters in
+    # order of appearance in the anchorpoints file
+    df = df.sort_values(["component", "position"])
+    df["gene"] = df.index
+    sps = list(pd.unique(genes_data["sp"].astype(str)))
+    by = [df["component"].values, df["sp"].astype(str).values]
+    genes = df.groupby(by)["gene"].agg(", ".join).unstack().reindex(
+        columns=sps).fillna("")
+    counts = df.groupby(by).size().unstack().reindex(
+        columns=sps).fillna(0).astype(int)
+    # every cluster is labeled by the family of its first gene
+    family = df.groupby("component")["family"].first()
+    genes.index = counts.index = family.loc[genes.index].values
+    genes.columns.name = counts.columns.name = None
     return genes, counts
 
-def get_network(anchorpoints):
-    G = nx.Graph()
-    with open(anchorpoints, "r") as f:
-        for line in f:
-            l = line.strip().split()
-            if l[0] == "id":
-                continue
-            gene1, gene2 = l[3], l[4]
-            if gene1 not in G:
-                G.add_node(gene1)
-            if gene2 not in G:
-                G.add_node(gene2)
-            G.add_edge(gene1, gene2)
-    return G
+
+def anchor_codes(anchorpoints):
+    """
+    Gene pairs `(x, y, genes)` as in `gene_pairs`, for anchor points with
+    categorical genes.
+    """
+    genes = anchorpoints["gene_x"].cat.categories
+    x = anchorpoints["gene_x"].cat.codes.values
+    y = anchorpoints["gene_y"]
+    if not y.cat.categories.equals(genes):
+        genes = genes.union(y.cat.categories, sort=False)
+        x = pd.Categorical(anchorpoints["gene_x"], categories=genes).codes
+    y = pd.Categorical(y, categories=genes).codes
+    return x, y, np.asarray(genes)
+
+
+def connected_components(u, v, n):
+    """
+    Connected components for a graph with `n` nodes and edges `(u[i], v[i])`.
+    Returns for every node the smallest node index in its component. Roots of
+    the union-find forest are hooked onto smaller roots for all edges at
+    once, followed by pointer jumping until every node points to its root.
+    """
+    parent = np.arange(n)
+    while True:
+        pu, pv = parent[u], parent[v]
+        lo, hi = np.minimum(pu, pv), np.maximum(pu, pv)
+        merge = lo != hi
+        if not merge.any():
+            return parent
+        np.minimum.at(parent, hi[merge], lo[merge])
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
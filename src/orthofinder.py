@@ -27,41 +27,72 @@ import pandas as pd
 import numpy as np
 import logging
 import os
+from itertools import chain
 
 
-def get_families_orthofinder(orthofinder_df, species):
+def get_families_orthofinder(orthofinder_df, species, chunksize=None):
     """
     Get the gene families for the species of interest. This is the only
     interaction with the OrthoFinder dataframe I guess. Species identifiers
-    should be unique prefixes.
+    should be unique prefixes. Only the columns for the species of interest
+    are read. If `chunksize` is given, an iterator over data frames with
+    `chunksize` families each is returned.
     """
-    df = pd.read_csv(orthofinder_df, sep="\t", index_col=0)
+    header = pd.read_csv(orthofinder_df, sep="\t", index_col=0, nrows=0)
     # let's be forgiving when it comes to the species names, allow prefixes
-    unique_prefix(df.columns, species)
+    unique_prefix(header.columns, species)
     f = lambda x, y: x.startswith(y)
-    cols = [x for x in df.columns if any([f(x, y) for y in species])]
-    df = df[cols]
-    df.fillna("", inplace=True)
-    return df
+    usecols = [0] + [i+1 for i, x in enumerate(header.columns)
+        if any([f(x, y) for y in species])]
+    reader = pd.read_csv(orthofinder_df, sep="\t", index_col=0, dtype=str,
+        usecols=usecols, chunksize=chunksize)
+    if chunksize:
+        return (df.fillna("") for df in reader)
+    return reader.fillna("")
 
 
 def write_families_from_df(df, fname):
     """
     Write families file for I-ADHoRe based on a data frame where every row
-    consists of one family.
+    consists of one family. `df` may also be an iterable of such data frames
+    (e.g. as obtained with `get_families_orthofinder` using `chunksize`), in
+    which case the families file is written chunk by chunk.
     """
+    if isinstance(df, pd.DataFrame):
+        df = [df]
     genes = {}
     with open(fname, "w") as f:
-        for row in df.index:
-            for x in df.loc[row].apply(lambda x : x.split(", ")):
-                gs = [y for y in x if y != ""]
-                strs = ["{}\t{}\n".format(y, row) for y in gs]
-                f.write("".join(strs))
-                for g in gs:
-                    genes[g] = row
+        for chunk in df:
+            fams = families_from_df(chunk)
+            fams.to_csv(f, sep="\t", header=False, index=False)
+            genes.update(zip(fams["gene"], fams["family"]))
     return os.path.abspath(fname), genes
 
 
+def families_from_df(df):
+    """
+    Get a gene to family table for a data frame where every row consists of
+    one family, with comma-separated genes in every cell. Genes are in the
+    order of the families and then the columns of `df`.
+    """
+    s = df.stack()
+    s = s[s != ""].str.split(", ")
+    gs = np.array(list(chain.from_iterable(s)), dtype=object)
+    fs = np.repeat(s.index.get_level_values(0).values, s.str.len().values)
+    fams = pd.DataFrame({"gene": gs, "family": fs})
+    return fams[fams["gene"] != ""]
+
+
+def read_families(fname):
+    """
+    Get the gene to family mapping from a families file written by
+    `write_families_from_df` or `write_families_from_mcl`.
+    """
+    df = pd.read_csv(fname, sep="\t", header=None, names=["gene", "family"],
+        dtype=str)
+    return os.path.abspath(fname), dict(zip(df["gene"], df["family"]))
+
+
 def write_families_from_mcl(df, fname):
     genes = {}
     with open(fname, "w") as o:
@@ -84,17 +115,12 @@ def unique_prefix(strs, prefixes):
 
 
 def orthogroup_poisson_filter(df, threshold=3):
-    df.fillna("", inplace=True)
+    df = df.fillna("")
     n0 = len(df.index)
-    counts = df[df.columns].applymap(
-        lambda x: len([y for y in x.split(", ") if y != '']))
-    family_sizes = counts.apply(lambda x: sum(x), axis=1)
-    idx = poisson_outlier(family_sizes, threshold)
-    counts = counts.loc[idx]
-    df = df.loc[idx]
-    n1 = len(df.index)
-    idx = counts.apply(lambda x: np.all(poisson_outlier(x, threshold)), axis=1)
-    df = df.loc[idx]
+    counts = family_counts(df)
+    idx1, idx2 = poisson_filter_masks(counts, threshold)
+    n1 = idx1.sum()
+    df = df[idx1 & idx2]
     n2 = len(df.index)
     logging.info("Retained {}/{} families after family-size outlier "
         "filter".format(n1, n0))
@@ -103,6 +129,45 @@ def orthogroup_poisson_filter(df, threshold=3):
     return df
 
 
+def poisson_filter_sweep(df, thresholds):
+    """
+    Get the number of families retained by the Poisson outlier filter for a
+    number of thresholds, computing the family counts only once.
+    """
+    counts = family_counts(df.fillna(""))
+    rows = []
+    for t in thresholds:
+        idx1, idx2 = poisson_filter_masks(counts, t)
+        rows.append({"threshold": t, "families": len(counts.index),
+            "size_filter": idx1.sum(), "entry_filter": (idx1 & idx2).sum()})
+    return pd.DataFrame(rows, columns=[
+        "threshold", "families", "size_filter", "entry_filter"])
+
+
+def family_counts(df):
+    """
+    Count the number of genes for every family (row) and species (column),
+    for comma-separated gene lists in every cell.
+    """
+    counts = {}
+    for col in df.columns:
+        s = df[col]
+        counts[col] = np.where(s != "", s.str.count(", ") + 1, 0)
+    return pd.DataFrame(counts, index=df.index, columns=df.columns)
+
+
+def poisson_filter_masks(counts, threshold):
+    """
+    Returns two boolean arrays for the family-size and entry outlier filters,
+    where the entry filter is applied to every family separately.
+    """
+    x = counts.values
+    idx1 = poisson_outlier(x.sum(axis=1), threshold)
+    y = 2*np.sqrt(x)
+    idx2 = np.all(y < np.median(y, axis=1)[:, None] + threshold, axis=1)
+    return idx1, idx2
+
+
 def poisson_outlier(vector, threshold):
     """
     Returns a vector with True for non-outliers, False for outliers.
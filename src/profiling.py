@@ -0,0 +1,210 @@
+"""
+Stage profiling for the py-adhore subcommands (`--profile`). Subcommands mark
+their stages with `stage`, which records the wall time, CPU time (of
+py-adhore itself and of finished child processes such as I-ADHoRe) and peak
+memory of every stage when profiling is enabled, and does nothing otherwise.
+The report is written as JSON to the output directory of the subcommand.
+
+Peak memory is the resident set size high-water mark, which is reset at the
+start of every stage on Linux. Elsewhere it is the peak of the process so far.
+"""
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+_profiler = None
+
+
+class Profiler:
+    def __init__(self, command, cprofile=None):
+        self.command = command
+        self.cprofile = cprofile
+        self.outdir = "."
+        self.stages = []
+        self.stack = []
+        self.started = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.t0 = time.perf_counter()
+
+    def enter(self, name):
+        hwm = peak_rss()
+        for s in self.stack:
+            s["peak"] = max(s["peak"], hwm or 0)
+        reset_peak_rss()
+        s = {"name": name, "peak": 0, "children_rss": children_peak_rss(),
+            "wall": time.perf_counter(), "cpu": time.process_time(),
+            "cpu_children": _children_cpu()}
+        self.stack.append(s)
+        return s
+
+    def exit(self, s):
+        self.stack.pop()
+        peak = max(s["peak"], peak_rss() or 0)
+        if self.stack:
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+        children_rss = children_peak_rss()
+        self.stages.append({"stage": s["name"],
+            "parent": self.stack[-1]["name"] if self.stack else None,
+            "level": len(self.stack), "start": s["wall"] - self.t0,
+            "wall": time.perf_counter() - s["wall"],
+            "cpu": time.process_time() - s["cpu"],
+            "cpu_children": _children_cpu() - s["cpu_children"],
+            "peak_rss_kb": peak or None,
+            "peak_rss_children_kb": children_rss if children_rss and
+                children_rss > (s["children_rss"] or 0) else None})
+
+    def report(self):
+        return {"command": self.command, "argv": sys.argv,
+            "started": self.started, "peak_rss_scope": "stage" if
+            os.path.exists("/proc/self/clear_refs") else "process",
+            "stages": sorted(self.stages, key=lambda s: s["start"])}
+
+
+def start(command, cprofile=None):
+    """
+    Enable profiling for `command`. If `cprofile` is given, the stage with
+    that name is also profiled with cProfile.
+    """
+    global _profiler
+    _profiler = Profiler(command, cprofile)
+
+
+def enabled():
+    return _profiler is not None
+
+
+def set_outdir(outdir):
+    """
+    Set the directory the profile report (and cProfile output) is written
+    to, by default the working directory (also used when the directory does
+    not exist when profiling finishes). No-op when profiling is off.
+    """
+    if _profiler is not None:
+        _profiler.outdir = outdir
+
+
+@contextmanager
+def stage(name):
+    """
+    Mark a stage of a subcommand, stages can be nested.
+    """
+    if _profiler is None:
+        yield
+        return
+    s = _profiler.enter(name)
+    pr = None
+    if name == _profiler.cprofile:
+        import cProfile
+        pr = cProfile.Profile()
+        pr.enable()
+    try:
+        yield
+    finally:
+        if pr is not None:
+            pr.disable()
+            fname = os.path.join(_outdir(_profiler),
+                "profile_{}_{}.prof".format(_profiler.command, name))
+            pr.dump_stats(fname)
+            logging.info("cProfile output for stage `{}` written to `{}` "
+                "(view with `python -m pstats`)".format(name, fname))
+        _profiler.exit(s)
+
+
+def finish():
+    """
+    Write the profile report, log the stage timings and disable profiling.
+    Returns the report file name.
+    """
+    import json
+    global _profiler
+    if _profiler is None:
+        return None
+    p, _profiler = _profiler, None
+    fname = os.path.join(_outdir(p), "profile_{}.json".format(p.command))
+    report = p.report()
+    with open(fname, "w") as f:
+        json.dump(report, f, indent=2)
+    if p.cprofile and p.cprofile not in [s["stage"] for s in p.stages]:
+        logging.warning("No stage `{}` was run, stages: {}".format(p.cprofile,
+            ", ".join(s["stage"] for s in report["stages"])))
+    for s in report["stages"]:
+        logging.info("{:<24}{:>9.2f} s wall{:>9.2f} s cpu{:>9.2f} s cpu "
+            "(children){:>12} kB".format(
+            "  " * s["level"] + s["stage"], s["wall"],
+            s["cpu"], s["cpu_children"], s["peak_rss_kb"] or "-"))
+    logging.info("Profile written to `{}`".format(fname))
+    return fname
+
+
+def _outdir(p):
+    # the output directory may not exist yet, e.g. when a subcommand failed
+    if not os.path.isdir(p.outdir):
+        logging.warning("Output directory `{}` does not exist, writing "
+            "profile output to the working directory".format(p.outdir))
+        return "."
+    return p.outdir
+
+
+def peak_rss(pid=None):
+    """
+    Resident set size high-water mark (kB) of process `pid` (this process by
+    default), from `/proc`. Elsewhere, the peak RSS of this process from
+    `getrusage` is used (None for other processes or if not available).
+    """
+    try:
+        with open("/proc/{}/status".format(pid if pid else "self"), "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    if pid:
+        return None
+    try:
+        import resource
+        return _rusage_kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except ImportError:
+        return None
+
+
+def reset_peak_rss():
+    """
+    Reset the high-water mark of this process to the current RSS (Linux >=
+    4.0, no-op elsewhere).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except IOError:
+        pass
+
+
+def children_rusage():
+    """
+    Resource usage of the finished child processes, None if not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _rusage_kb(maxrss):
+    # ru_maxrss is in bytes on macOS, in kB elsewhere
+    return maxrss / 1024 if sys.platform == "darwin" else maxrss
+
+
+def children_peak_rss():
+    """
+    Peak RSS (kB) of the largest finished child process, None if not
+    available.
+    """
+    r = children_rusage()
+    return _rusage_kb(r.ru_maxrss) if r else None
+
+
+def _children_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
@@ -0,0 +1,235 @@
+"""
+Python API over a py-adhore output directory. Tables are read on first
+access and cached, and the indexes (gene to anchor points, multiplicon to
+segments, chromosome to genes) are built on first use, e.g.
+
+    from src.results import Results
+    res = Results("py-adhore.out")
+    res.anchors_of("AT1G01010")
+    res.segments_of(42)
+    genes, counts = res.clusters()
+"""
+import logging
+import os
+import numpy as np
+import pandas as pd
+from src.anchorpoints import read_anchorpoints
+from src.store import read_genes_data
+from src.utils import read_adhore_config
+
+
+class Results():
+    """
+    Lazily loaded I-ADHoRe results for the py-adhore output directory
+    `outdir`. The paths of the genes data, the I-ADHoRe output directory and
+    the segments and anchorpoints files can be given explicitly for
+    non-standard layouts.
+    """
+    def __init__(self, outdir, genes_data=None, adhore_out=None,
+            segments=None, anchorpoints=None):
+        self.outdir = outdir
+        self.genes_data_file = genes_data if genes_data else os.path.join(
+            outdir, "genes_data.csv")
+        if not adhore_out:
+            adhore_out = os.path.join(outdir, "i-adhore-out")
+            conf = os.path.join(outdir, "adhore.conf")
+            if not os.path.isdir(adhore_out) and os.path.isfile(conf):
+                adhore_out = read_adhore_config(conf)["output_path"]
+        self.adhore_out = adhore_out
+        self.segments_file = segments if segments else os.path.join(
+            adhore_out, "segments.txt")
+        self.anchorpoints_file = anchorpoints if anchorpoints else \
+            os.path.join(adhore_out, "anchorpoints.txt")
+        self._cache = {}
+
+    def _cached(self, key, f):
+        if key not in self._cache:
+            self._cache[key] = f()
+        return self._cache[key]
+
+    def _adhore_table(self, fname):
+        return pd.read_csv(fname, sep="\t", index_col=0)
+
+    # tables
+    @property
+    def genes_data(self):
+        return self._cached("genes_data",
+            lambda: read_genes_data(self.genes_data_file))
+
+    @property
+    def segments(self):
+        return self._cached("segments",
+            lambda: self._adhore_table(self.segments_file))
+
+    @property
+    def multiplicons(self):
+        return self._cached("multiplicons",
+            lambda: self._adhore_table(os.path.join(self.adhore_out,
+                "multiplicons.txt")))
+
+    @property
+    def anchorpoints(self):
+        """
+        Anchor points with categorical genes (using the memory-mapped
+        version when available, see `src.anchorpoints`).
+        """
+        return self._cached("anchorpoints",
+            lambda: read_anchorpoints(self.anchorpoints_file))
+
+    @property
+    def summary(self):
+        return self._cached("summary", lambda: pd.read_csv(
+            os.path.join(self.outdir, "py-adhore.csv"), index_col=0))
+
+    @property
+    def karyotype(self):
+        """
+        Gene-based karyotype (last gene end and genome of every chromosome).
+        """
+        return self._cached("karyotype", lambda: self.genes_data.groupby(
+            ["chrom"], observed=True)[["stop", "sp"]].max())
+
+    def _anchors(self):
+        # the anchor points table if it was loaded already, otherwise the
+        # file, of which functions then read only the columns they need
+        return self._cache.get("anchorpoints", self.anchorpoints_file)
+
+    # indexes
+    def _gene_anchor_index(self):
+        # anchor point rows sorted by gene code (of either gene of the pair)
+        ap = self.anchorpoints
+        x = ap["gene_x"].cat.codes.values
+        y = ap["gene_y"].cat.codes.values
+        codes = np.concatenate([x, y])
+        rows = np.concatenate([np.arange(len(x))] * 2)
+        order = np.argsort(codes, kind="stable")
+        codes, rows = codes[order], rows[order]
+        offsets = np.searchsorted(codes, np.arange(
+            len(ap["gene_x"].cat.categories) + 1))
+        genes = pd.Index(ap["gene_x"].cat.categories)
+        return genes, rows, offsets
+
+    def _multiplicon_index(self):
+        seg = self.segments
+        order = np.argsort(seg["multiplicon"].values, kind="stable")
+        m = seg["multiplicon"].values[order]
+        return m, order
+
+    def _chromosome_index(self):
+        gd = self.genes_data
+        chrom = gd["chrom"].astype(str).values
+        order = np.lexsort((gd["start"].values, chrom))
+        chrom = chrom[order]
+        bounds = np.r_[0, np.nonzero(chrom[1:] != chrom[:-1])[0] + 1,
+            len(chrom)]
+        return {chrom[i]: order[i:j] for i, j in zip(bounds[:-1],
+            bounds[1:])}
+
+    def anchors_of(self, gene):
+        """
+        All anchor points (rows of `anchorpoints`) involving `gene`.
+        """
+        genes, rows, offsets = self._cached("gene_anchors",
+            self._gene_anchor_index)
+        i = genes.get_indexer([gene])[0]
+        if i < 0:
+            return self.anchorpoints.iloc[[]]
+        rows = np.sort(rows[offsets[i]:offsets[i+1]])
+        return self.anchorpoints.iloc[rows]
+
+    def partners(self, gene):
+        """
+        The genes paired with `gene` in anchor points.
+        """
+        ap = self.anchors_of(gene)
+        x = ap["gene_x"].astype(str).values
+        y = ap["gene_y"].astype(str).values
+        return pd.unique(np.where(x == gene, y, x))
+
+    def segments_of(self, multiplicon):
+        """
+        The segments of a multiplicon, in the order of `segments`.
+        """
+        m, order = self._cached("multiplicon_segments",
+            self._multiplicon_index)
+        i = np.searchsorted(m, multiplicon, side="left")
+        j = np.searchsorted(m, multiplicon, side="right")
+        return self.segments.iloc[np.sort(order[i:j])]
+
+    def genes_on(self, chrom):
+        """
+        The genes on a chromosome (rows of `genes_data`), sorted by start.
+        """
+        index = self._cached("chromosome_genes", self._chromosome_index)
+        if chrom not in index:
+            return self.genes_data.iloc[[]]
+        return self.genes_data.iloc[index[chrom]]
+
+    # derived results
+    def clusters(self):
+        """
+        Syntenic clusters and their phyletic profiles, see
+        `src.network.get_clusters`.
+        """
+        from src.network import get_clusters
+        return self._cached("clusters",
+            lambda: get_clusters(self._anchors(), self.genes_data))
+
+    def spans(self):
+        """
+        Genome, chromosome, start and stop coordinate of every segment, with
+        its multiplicon and length (bp).
+        """
+        def f():
+            from src.circos import segment_coordinates
+            df = segment_coordinates(self.segments, self.genes_data)
+            df["length"] = df["stop"] - df["start"]
+            return df
+        return self._cached("spans", f)
+
+    def intervals(self, fname=None):
+        """
+        Interval index for region and gene queries (see `src.intervals`),
+        loaded from `fname` if that file is up to date and built otherwise.
+        """
+        def f():
+            from src.intervals import IntervalIndex, build_index, is_fresh
+            inputs = [self.genes_data_file, self.segments_file,
+                self.anchorpoints_file]
+            if fname and is_fresh(fname, inputs):
+                try:
+                    return IntervalIndex.load(fname)
+                except ValueError as e:
+                    logging.warning("{}, rebuilding it".format(e))
+            elif fname and os.path.isfile(fname):
+                logging.warning("Index `{}` is out of date, rebuilding "
+                    "it".format(fname))
+            return build_index(self.genes_data, self.segments,
+                self._anchors())
+        return self._cached("intervals", f)
+
+    def species_pair(self, g1, g2=None):
+        """
+        Segments and anchor points between genomes `g1` and `g2` (within
+        `g1` if `g2` is not given). Segments are those of the multiplicons
+        with segments on both genomes, restricted to these genomes. Returns
+        `(segments, anchorpoints)`.
+        """
+        g2 = g2 if g2 else g1
+        seg = self.segments
+        seg = seg[seg["genome"].isin([g1, g2])]
+        if g1 != g2:
+            n = seg.groupby("multiplicon")["genome"].nunique()
+            seg = seg[seg["multiplicon"].isin(n[n == 2].index)]
+        else:
+            n = seg.groupby("multiplicon").size()
+            seg = seg[seg["multiplicon"].isin(n[n >= 2].index)]
+        # genome of every anchor gene, looked up once per distinct gene
+        ap = self.anchorpoints
+        gd = self.genes_data
+        pos = gd.index.get_indexer(ap["gene_x"].cat.categories)
+        sp = np.where(pos >= 0, gd["sp"].astype(str).values[pos], "")
+        sx = sp[ap["gene_x"].cat.codes.values]
+        sy = sp[ap["gene_y"].cat.codes.values]
+        keep = ((sx == g1) & (sy == g2)) | ((sx == g2) & (sy == g1))
+        return seg, ap[keep]
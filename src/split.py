@@ -0,0 +1,118 @@
+"""
+Splitting a many-genome I-ADHoRe analysis in within-genome and pairwise
+(between two genomes) jobs, which share the families file and gene lists.
+The jobs are listed in a tab-separated manifest (`jobs.tsv`: name, config,
+number of threads, output path), so they can be run with the local process
+pool or be submitted elsewhere, after which the results are merged into one
+result set with renumbered multiplicons.
+
+Note that multiplicons involving segments from more than two genomes can not
+be detected in this way. From pairwise jobs only multiplicons with segments
+in both genomes are retained, within-genome multiplicons come from the
+within-genome jobs.
+"""
+import logging
+import os
+import pandas as pd
+from src.utils import write_adhore_config
+
+
+def write_split_configs(conf, outdir):
+    """
+    Write one I-ADHoRe configuration for every genome and every pair of
+    genomes in `conf["lists"]`, returns the manifest data frame.
+    """
+    jobs = []
+    genomes = conf["lists"]
+    pairs = [[g] for g in genomes]
+    pairs += [[g, h] for i, g in enumerate(genomes) for h in genomes[i+1:]]
+    for lists in pairs:
+        name = "__".join([g["genome"] for g in lists])
+        jobdir = os.path.join(outdir, name)
+        os.makedirs(jobdir, exist_ok=True)
+        c = dict(conf)
+        c["lists"] = lists
+        c["output_path"] = os.path.abspath(os.path.join(jobdir, "i-adhore-out"))
+        fn = write_adhore_config(c, os.path.join(jobdir, "adhore.conf"))
+        jobs.append({"name": name, "pairwise": int(len(lists) == 2),
+            "config": fn,
+            "threads": int(conf.get("number_of_threads", 1)),
+            "output_path": c["output_path"]})
+    return pd.DataFrame(jobs, columns=[
+        "name", "pairwise", "config", "threads", "output_path"])
+
+
+def write_manifest(jobs, fname):
+    jobs.to_csv(fname, sep="\t", index=False)
+    return os.path.abspath(fname)
+
+
+def read_manifest(fname):
+    return pd.read_csv(fname, sep="\t")
+
+
+def read_adhore_output(outdir, name):
+    return pd.read_csv(os.path.join(outdir, name + ".txt"), sep="\t")
+
+
+def merge_results(jobs, outdir):
+    """
+    Merge the multiplicons, segments and anchorpoints of the jobs in the
+    manifest `jobs` into `outdir`, renumbering multiplicons, segments,
+    anchor points and baseclusters. The `parent` of a multiplicon (empty for
+    level 2 multiplicons) always refers to a multiplicon of the same job, if
+    the parent is not retained it is replaced by its closest retained
+    ancestor (or left empty if there is none).
+    """
+    os.makedirs(outdir, exist_ok=True)
+    merged = {"multiplicons": [], "segments": [], "anchorpoints": []}
+    offsets = {"multiplicons": 0, "segments": 0, "anchorpoints": 0,
+        "basecluster": 0}
+    for row in jobs.itertuples():
+        res = {k: read_adhore_output(row.output_path, k) for k in merged}
+        seg = res["segments"]
+        # multiplicons to retain
+        ngenomes = seg.groupby("multiplicon")["genome"].nunique()
+        keep = ngenomes[ngenomes > 1].index if row.pairwise else \
+            ngenomes.index
+        logging.info("{}: retaining {}/{} multiplicons".format(
+            row.name, len(keep), len(res["multiplicons"].index)))
+        mp = res["multiplicons"]
+        parents = dict(zip(mp["id"], mp["parent"]))
+        mp = mp[mp["id"].isin(keep)].copy()
+        new_ids = dict(zip(mp["id"], range(
+            offsets["multiplicons"] + 1,
+            offsets["multiplicons"] + len(mp.index) + 1)))
+        renumber = lambda x: x.map(new_ids)
+        mp["parent"] = pd.array([retained_parent(p, parents, new_ids)
+            for p in mp["parent"]], dtype="Int64")
+        seg = seg[seg["multiplicon"].isin(keep)].copy()
+        ap = res["anchorpoints"]
+        ap = ap[ap["multiplicon"].isin(keep)].copy()
+        ap["basecluster"] = ap["basecluster"] + offsets["basecluster"]
+        offsets["basecluster"] = max(offsets["basecluster"],
+            ap["basecluster"].max() + 1 if len(ap.index) else 0)
+        for k, df in [("multiplicons", mp), ("segments", seg),
+                ("anchorpoints", ap)]:
+            if k == "multiplicons":
+                df["id"] = renumber(df["id"])
+            else:
+                df["multiplicon"] = renumber(df["multiplicon"])
+                df["id"] = range(offsets[k] + 1, offsets[k] + len(df.index) + 1)
+            offsets[k] += len(df.index)
+            merged[k].append(df)
+    for k, dfs in merged.items():
+        fn = os.path.join(outdir, k + ".txt")
+        pd.concat(dfs).to_csv(fn, sep="\t", index=False)
+    return os.path.abspath(outdir)
+
+
+def retained_parent(p, parents, new_ids):
+    """
+    New id of the closest retained ancestor of a multiplicon with parent `p`
+    (`parents` maps the multiplicons of a job to their parent, `new_ids` the
+    retained multiplicons to their new id). Returns `pd.NA` if there is none.
+    """
+    while pd.notna(p) and p not in new_ids:
+        p = parents.get(p)
+    return new_ids[p] if pd.notna(p) else pd.NA
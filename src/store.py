@@ -0,0 +1,106 @@
+"""
+Compact binary columnar storage of data frames, using numpy `.npz` archives
+so that no additional dependencies are required. String columns are stored as
+categorical codes and categories, numeric columns as they are. Categorical
+columns are restored as (ordered) categoricals, other string columns as plain
+object columns.
+
+The genes data table is stored both as CSV and `.npz`; readers prefer the
+latter when it is at least as recent as the CSV file.
+"""
+import numpy as np
+import pandas as pd
+import os
+
+
+def write_table(df, fname):
+    """
+    Write a data frame (including its index) to a `.npz` archive. The
+    archive is written to a temporary file first and then moved, so that
+    concurrent readers never see a partial file.
+    """
+    arrays = {}
+    kinds = []
+    columns = [df.index] + [df[c] for c in df.columns]
+    for i, col in enumerate(columns):
+        col = pd.Series(col)
+        key = "c{}".format(i)
+        if isinstance(col.dtype, pd.CategoricalDtype) or not \
+                pd.api.types.is_numeric_dtype(col.dtype):
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                kinds.append("ocat" if col.cat.ordered else "cat")
+            else:
+                kinds.append("str")
+            cat = pd.Categorical(col)
+            arrays[key] = cat.codes
+            arrays[key + "_categories"] = np.asarray(
+                cat.categories.astype(str), dtype=str)
+        else:
+            kinds.append("num")
+            arrays[key] = col.values
+    names = ["" if df.index.name is None else str(df.index.name)]
+    arrays["_columns"] = np.array(names + [str(c) for c in df.columns])
+    arrays["_kinds"] = np.array(kinds)
+    tmp = "{}.{}.tmp".format(fname, os.getpid())
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, fname)
+    return os.path.abspath(fname)
+
+
+def read_table(fname):
+    """
+    Read a data frame written with `write_table`.
+    """
+    with np.load(fname, allow_pickle=False) as npz:
+        names = list(npz["_columns"])
+        kinds = list(npz["_kinds"])
+        columns = []
+        for i, kind in enumerate(kinds):
+            key = "c{}".format(i)
+            if kind == "num":
+                columns.append(npz[key])
+                continue
+            cat = pd.Categorical.from_codes(npz[key],
+                categories=npz[key + "_categories"], ordered=kind == "ocat")
+            if kind == "str":
+                cat = np.asarray(cat, dtype=object)
+            columns.append(cat)
+    index = pd.Index(columns[0], name=names[0] if names[0] else None)
+    return pd.DataFrame(dict(zip(names[1:], columns[1:])), index=index,
+        columns=names[1:])
+
+
+GENES_DATA_CATEGORICALS = ["family", "feat", "chrom", "sp", "strand"]
+
+
+def write_genes_data(gdata, fname):
+    """
+    Write the genes data table to `fname` (CSV) and to the binary version
+    with the `.npz` extension, where the string columns are stored as ordered
+    categoricals (so that e.g. `max` behaves as for strings) and coordinates
+    as integers.
+    """
+    gdata.to_csv(fname)
+    df = gdata.copy()
+    for col in GENES_DATA_CATEGORICALS:
+        df[col] = pd.Categorical(df[col].astype(str), ordered=True)
+    for col in ["start", "stop"]:
+        df[col] = df[col].astype(np.int64)
+    write_table(df, os.path.splitext(fname)[0] + ".npz")
+    return os.path.abspath(fname)
+
+
+def read_genes_data(fname):
+    """
+    Read the genes data table, preferring the binary version if it exists
+    and is not older than the CSV file (or if there is no CSV file).
+    """
+    base, ext = os.path.splitext(fname)
+    if ext == ".npz":
+        return read_table(fname)
+    npz = base + ".npz"
+    if os.path.isfile(npz) and (not os.path.isfile(fname) or
+            os.path.getmtime(npz) >= os.path.getmtime(fname)):
+        return read_table(npz)
+    return pd.read_csv(fname, index_col=0)
@@ -0,0 +1,73 @@
+"""
+Parameter sweeps for I-ADHoRe. Starting from the configuration written by
+`py-adhore of` (without `--run`), one configuration file is written per point
+of a parameter grid, each with its own output path but sharing the families
+file and gene lists. The I-ADHoRe jobs are run concurrently under a total
+core budget, and the number of multiplicons, segments and anchor points is
+compared across all settings.
+"""
+import itertools
+import logging
+import os
+import pandas as pd
+from src.utils import read_adhore_config, write_adhore_config
+from src.adhore import count_results, run_adhore_jobs
+
+SWEEP_PARAMETERS = ["gap_size", "cluster_gap", "q_value", "prob_cutoff",
+    "anchor_points"]
+
+
+def parameter_grid(params):
+    """
+    All combinations for a dictionary with lists of parameter values.
+    """
+    keys = list(params.keys())
+    return [dict(zip(keys, x)) for x in itertools.product(
+        *[params[k] for k in keys])]
+
+
+def write_sweep_configs(conf, grid, outdir):
+    """
+    Write one I-ADHoRe configuration file per grid point, in a numbered
+    subdirectory of `outdir`. Returns the list of job directories.
+    """
+    jobs = []
+    for i, params in enumerate(grid):
+        jobdir = os.path.join(outdir, "{:03d}".format(i))
+        os.makedirs(jobdir, exist_ok=True)
+        c = dict(conf)
+        c.update(params)
+        c["output_path"] = os.path.abspath(os.path.join(jobdir, "i-adhore-out"))
+        write_adhore_config(c, os.path.join(jobdir, "adhore.conf"))
+        jobs.append(jobdir)
+    return jobs
+
+
+def sweep(conf_file, params, outdir, cores=1, threads=None,
+        executable="i-adhore"):
+    """
+    Run an I-ADHoRe parameter sweep for the parameter values in `params`
+    (a dictionary with lists of values), starting from the configuration in
+    `conf_file`. Writes and returns a table with the results for every grid
+    point.
+    """
+    conf = read_adhore_config(conf_file)
+    if threads:
+        conf["number_of_threads"] = threads
+    grid = parameter_grid(params)
+    logging.info("Writing {} I-ADHoRe configuration files".format(len(grid)))
+    jobdirs = write_sweep_configs(conf, grid, outdir)
+    n = int(conf.get("number_of_threads", 1))
+    jobs = [(os.path.join(d, "adhore.conf"), n,
+        os.path.join(d, "i-adhore.log")) for d in jobdirs]
+    codes = run_adhore_jobs(jobs, cores=cores, executable=executable)
+    rows = []
+    for params, d, code in zip(grid, jobdirs, codes):
+        row = {"job": os.path.basename(d)}
+        row.update(params)
+        row["exit_code"] = code
+        row.update(count_results(os.path.join(d, "i-adhore-out")))
+        rows.append(row)
+    df = pd.DataFrame(rows).set_index("job")
+    df.to_csv(os.path.join(outdir, "sweep.csv"))
+    return df
@@ -40,6 +40,29 @@ def write_adhore_config(conf, path):
     return os.path.abspath(path)
 
 
+def read_adhore_config(path):
+    """
+    Read an I-ADHoRe config file (as written by `write_adhore_config`).
+    """
+    conf = {}
+    genome = None
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                genome = None
+            elif line.startswith("genome="):
+                genome = {"genome": line.split("=", 1)[1], "lists": []}
+                conf.setdefault("lists", []).append(genome)
+            elif genome is not None:
+                genome["lists"].append(line)
+            else:
+                k, v = line.split("=", 1)
+                conf[k] = v
+    conf.setdefault("lists", [])
+    return conf
+
+
 def parse_feat_attr(features, attributes, species):
     """
     Parse and interpret the features and attributes option settings for CLI
@@ -0,0 +1,70 @@
+import json
+import os
+from src.adhore import run_adhore, run_adhore_jobs, NOT_RUN
+
+STUB = os.path.join(os.path.dirname(__file__), "stub", "i-adhore")
+
+
+def write_conf(tmp_path, name="adhore.conf", **kwargs):
+    fname = str(tmp_path / name)
+    with open(fname, "w") as f:
+        for k, v in kwargs.items():
+            f.write("{}={}\n".format(k, v))
+    return fname
+
+
+def test_run_adhore(tmp_path):
+    conf = write_conf(tmp_path)
+    log = str(tmp_path / "i-adhore.log")
+    metrics = str(tmp_path / "run_metrics.json")
+    m = run_adhore(conf, log, metrics=metrics, executable=STUB, poll=0.05)
+    assert m["exit_code"] == 0
+    assert not m["timed_out"]
+    assert m["command"] == [STUB, conf]
+    with open(metrics, "r") as f:
+        assert json.load(f) == m
+    for k in ["wall_time", "cpu_time", "user_time", "system_time"]:
+        assert m[k] >= 0
+    assert m["peak_rss_mb"] is None or m["peak_rss_mb"] > 0
+    with open(log, "r") as f:
+        lines = f.read().splitlines()
+    assert "Detecting multiplicons: 100%" in lines
+    assert "[stderr] stub warning" in lines
+
+
+def test_run_adhore_exit_code(tmp_path):
+    conf = write_conf(tmp_path, stub_exit_code=3)
+    m = run_adhore(conf, str(tmp_path / "i-adhore.log"), executable=STUB,
+        poll=0.05)
+    assert m["exit_code"] == 3
+    assert not m["timed_out"]
+
+
+def test_run_adhore_timeout(tmp_path):
+    conf = write_conf(tmp_path, stub_sleep=30)
+    m = run_adhore(conf, str(tmp_path / "i-adhore.log"), timeout=0.5,
+        executable=STUB, poll=0.05)
+    assert m["timed_out"]
+    assert m["exit_code"] != 0
+    assert m["wall_time"] < 10
+
+
+def test_run_adhore_jobs(tmp_path):
+    jobs = [(write_conf(tmp_path, "{}.conf".format(i), stub_exit_code=c), 1,
+        str(tmp_path / "{}.log".format(i))) for i, c in enumerate([0, 2, 0])]
+    codes = run_adhore_jobs(jobs, cores=2, poll=0.05, executable=STUB)
+    assert codes == [0, 2, 0]
+
+
+def test_missing_executable(tmp_path):
+    conf = write_conf(tmp_path)
+    missing = str(tmp_path / "no-i-adhore")
+    metrics = str(tmp_path / "run_metrics.json")
+    m = run_adhore(conf, str(tmp_path / "i-adhore.log"), metrics=metrics,
+        executable=missing)
+    assert m["exit_code"] == NOT_RUN
+    with open(metrics, "r") as f:
+        assert json.load(f)["exit_code"] == NOT_RUN
+    jobs = [(conf, 1, str(tmp_path / "{}.log".format(i))) for i in range(2)]
+    assert run_adhore_jobs(jobs, cores=2, poll=0.05,
+        executable=missing) == [NOT_RUN, NOT_RUN]
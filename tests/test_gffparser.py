@@ -0,0 +1,34 @@
+import os
+from src.adhore import gene_ranks
+from src.gffparser import load_gff, write_gene_lists
+
+
+def write_gff(fname, rows):
+    with open(fname, "w") as f:
+        f.write("##gff-version 3\n")
+        for chrom, feat, start, gene in rows:
+            f.write("\t".join([chrom, "test", feat, str(start),
+                str(start + 100), ".", "+", ".", "ID=" + gene]) + "\n")
+
+
+def test_gene_list_ranks(tmp_path):
+    # feature types given in non-alphabetical order: pseudogenes are listed
+    # before genes on every chromosome
+    rows = [("c1", "pseudogene" if i % 3 == 0 else "gene", 1000 * i,
+        "g{}".format(i)) for i in range(10)]
+    rows.append(("c2", "gene", 500, "g10"))
+    fname = str(tmp_path / "sp.gff")
+    write_gff(fname, rows)
+    gff = load_gff(fname, ["pseudogene", "gene"])
+    genes = {r[3]: "f1" for r in rows}
+    conf, gdata = write_gene_lists(gff, genes, "sp", str(tmp_path),
+        features=["pseudogene", "gene"])
+    with open(os.path.join(str(tmp_path), "sp", "c1.lst"), "r") as f:
+        lst = [x[:-1] for x in f.read().split()]
+    assert lst == ["g0", "g3", "g6", "g9", "g1", "g2", "g4", "g5", "g7", "g8"]
+    ranks = gene_ranks(gdata)["rank"]
+    assert list(ranks.loc[lst]) == list(range(10))
+    assert ranks["g10"] == 0
+    # genes data without ranks (from older versions) is in list order
+    ranks = gene_ranks(gdata.drop(columns=["rank"]))["rank"]
+    assert list(ranks.loc[lst]) == list(range(10))
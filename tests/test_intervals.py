@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from src.intervals import make_track, overlaps, search, parse_region, \
+    read_bed, IntervalIndex
+
+
+def random_intervals(rng, n, chroms=("c1", "c2", "c3"), length=1000):
+    chrom = rng.choice(chroms, size=n)
+    start = rng.integers(1, 100000, size=n)
+    # a few long intervals, so that the running maximum of stops matters
+    stop = start + np.where(rng.random(n) < 0.05, rng.integers(0, 50000,
+        size=n), rng.integers(0, length, size=n))
+    return chrom, start, stop
+
+
+def brute_force(track, chrom, start, stop):
+    pairs = []
+    for q in range(len(chrom)):
+        hit = (track["chrom"] == chrom[q]) & (track["start"] <= stop[q]) & \
+            (track["stop"] >= start[q])
+        pairs += [(q, r) for r in np.nonzero(hit)[0]]
+    return pairs
+
+
+def test_overlaps_brute_force():
+    rng = np.random.default_rng(1)
+    track = make_track(*random_intervals(rng, 2000), name=np.arange(2000))
+    chrom, start, stop = random_intervals(rng, 300, chroms=("c1", "c2",
+        "c3", "c4"), length=5000)
+    qi, rows = overlaps(track, chrom, start, stop)
+    assert list(zip(qi, rows)) == brute_force(track, chrom, start, stop)
+
+
+def test_overlaps_nested():
+    # one long interval spanning many short ones, and nested intervals
+    n = 10000
+    start = np.r_[1, np.arange(n) * 10 + 5, 50000, 50000, 50010]
+    stop = np.r_[10 ** 6, np.arange(n) * 10 + 9, 60000, 60000, 50020]
+    track = make_track(["c1"] * len(start), start, stop)
+    chrom = np.array(["c1"] * 4)
+    qstart, qstop = np.array([50001, 7, 0, 55000]), np.array([50012, 7, 3,
+        55000])
+    qi, rows, considered = search(track, chrom, qstart, qstop)
+    assert list(zip(qi, rows)) == brute_force(track, chrom, qstart, qstop)
+    # only overlapping intervals are considered, not every interval after
+    # the long one
+    assert considered == len(qi) == 11
+
+
+def test_overlaps_bounds():
+    track = make_track(["c1"] * 3, [10, 20, 30], [15, 25, 35])
+    # closed intervals: touching the first or last base is an overlap
+    qi, rows = overlaps(track, np.array(["c1", "c1", "c1", "c2"]),
+        np.array([15, 16, 36, 1]), np.array([20, 19, 40, 100]))
+    assert list(zip(qi, rows)) == [(0, 0), (0, 1)]
+
+
+def test_overlaps_empty():
+    track = make_track([], [], [])
+    qi, rows = overlaps(track, np.array(["c1"]), np.array([1]),
+        np.array([10]))
+    assert len(qi) == len(rows) == 0
+
+
+def test_parse_region():
+    assert parse_region("chr1:1,000-2,000") == ("chr1", 1000, 2000)
+    assert parse_region("scaffold:1:5-10") == ("scaffold:1", 5, 10)
+    assert parse_region("chr1")[:2] == ("chr1", 0)
+    for region in ["chr1:100", "chr1:a-b", ":1-10", "chr1:300-100", ""]:
+        with pytest.raises(ValueError):
+            parse_region(region)
+
+
+def test_read_bed(tmp_path):
+    fname = str(tmp_path / "regions.bed")
+    with open(fname, "w") as f:
+        f.write("track name=test\nbrowser position c1:1-100\n# comment\n"
+            "c1\t0\t100\tfirst\tx\t+\nc2\t9\t20\n\n")
+    chrom, start, stop, names = read_bed(fname)
+    assert list(chrom) == ["c1", "c2"]
+    assert list(start) == [1, 10]
+    assert list(stop) == [100, 20]
+    assert list(names) == ["first", "c2:10-20"]
+
+
+def test_query_bad_region(tmp_path):
+    from click.testing import CliRunner
+    from pyadhore import cli
+    result = CliRunner().invoke(cli, ["query", str(tmp_path), "-r",
+        "chr1:100"])
+    assert result.exit_code == 2
+    assert "is not a region" in result.output
+
+
+def test_load_old_index(tmp_path):
+    fname = str(tmp_path / "index.npz")
+    np.savez(fname, **{"{}.{}".format(t, k): np.array([]) for t in
+        ["genes", "segments", "anchors"] for k in ["chroms", "bounds",
+        "chrom", "start", "stop", "maxstop", "gene"]})
+    with pytest.raises(ValueError):
+        IntervalIndex.load(fname)
+
+
+def test_read_bed_errors(tmp_path):
+    fname = str(tmp_path / "regions.bed")
+    for content, line in [("c1\t0\t10\nc1\t5\n", 2),
+            ("track name=x\nc1\tstart\t10\n", 2)]:
+        with open(fname, "w") as f:
+            f.write(content)
+        with pytest.raises(ValueError, match="Line {} of".format(line)):
+            read_bed(fname)